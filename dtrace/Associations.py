@@ -2,18 +2,61 @@
 # Copyright (C) 2019 Emanuel Goncalves
 
 import logging
+import functools
 import numpy as np
 import pandas as pd
 import pkg_resources
 import dtrace.DataImporter as DataImporter
 from limix.qtl import scan
+from dtrace.LMMEngine import (
+    LMMEngine,
+    MultiTraitLMMEngine,
+    KinshipCache,
+    KinshipFactor,
+)
+from dtrace.AssociationsCheckpoint import AssociationCheckpoint
+from dtrace.AssociationsStore import AssociationStore
+from dtrace.AssociationsIndex import AssociationIndex
+from dtrace.AssociationsCube import AssociationCube
 from sklearn.preprocessing import StandardScaler
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from statsmodels.stats.multitest import multipletests
 
 
 dpath = pkg_resources.resource_filename("dtrace", "data/")
 
 
+# - Process pool workers: data shared by all the tasks of a worker is set once by the initializer
+_LMM_WORKER = {}
+
+
+def _lmm_worker_init(x, k, m, engine, kinship_cache_size):
+    _LMM_WORKER.update(
+        x=x,
+        k=k,
+        m=m,
+        engine=engine,
+        kinship_cache=(
+            None if k is None else KinshipCache(k, maxsize=kinship_cache_size)
+        ),
+    )
+
+
+def _lmm_worker_chunk(y, kwargs):
+    return [
+        Association.lmm_single_association(
+            y[[c]],
+            _LMM_WORKER["x"],
+            k=_LMM_WORKER["k"],
+            m=_LMM_WORKER["m"],
+            engine=_LMM_WORKER["engine"],
+            kinship_cache=_LMM_WORKER["kinship_cache"],
+            **kwargs,
+        )
+        for c in y
+    ]
+
+
 class Association:
     """
     Main class to test linear associations bewteen data-sets (e.g. drug response and CRISPR-Cas9 knockout viability
@@ -21,6 +64,10 @@ class Association:
 
     """
 
+    MULTIOMICS_DTYPES = ["crispr", "gexp", "genomic", "cn", "wes", "rnai"]
+
+    LMM_PARAMS_ATTR = "lmm_params"
+
     def __init__(
         self,
         pval_method="fdr_bh",
@@ -34,7 +81,11 @@ class Association:
         :param pval_method: Multiple hypothesis adjustment method. Any option available in multipletests
             (statsmodels.stats.multitest).
 
-        :param load_associations: Load associations (this implies the associations were already tested).
+        :param load_associations: Load associations (this implies the associations were already tested). Read from
+            the columnar stores (see AssociationStore) if these exist, otherwise from the CSV files.
+
+        Data-sets (crispr, drespo, genomic, gexp, cn, samplesheet, ppi and their importers) are loaded and filtered
+        the first time they are accessed, and kept. Importers are shared by all instances (DataImporter.DataRegistry).
 
         """
 
@@ -43,39 +94,6 @@ class Association:
         self.dcols = DataImporter.DrugResponse.DRUG_COLUMNS
         self.ppi_order = ["T", "1", "2", "3", "4", "5+", "-"]
 
-        # Import data-sets
-        self.crispr_obj = DataImporter.CRISPR()
-        self.drespo_obj = DataImporter.DrugResponse()
-        self.genomic_obj = DataImporter.Genomic()
-        self.gexp_obj = DataImporter.GeneExpression()
-        self.cn_obj = DataImporter.CopyNumber()
-
-        self.samples = list(
-            set.intersection(
-                set(self.drespo_obj.get_data().columns),
-                set(self.crispr_obj.get_data().columns),
-            )
-        )
-
-        logging.getLogger("DTrace").info(f"#(Samples)={len(self.samples)}")
-
-        # Import PPI and samplesheet
-        self.ppi = DataImporter.PPI()
-        self.samplesheet = DataImporter.Sample()
-
-        # Filter
-        self.crispr = self.crispr_obj.filter(subset=self.samples, scale=True)
-        self.drespo = self.drespo_obj.filter(subset=self.samples)
-        self.genomic = self.genomic_obj.filter(subset=self.samples, min_events=5)
-        self.gexp = self.gexp_obj.filter(subset=self.samples)
-        self.cn = self.cn_obj.filter(subset=self.samples)
-
-        logging.getLogger("DTrace").info(
-            f"#(Drugs)={self.drespo.shape[0]}; "
-            f"#(Genes)={self.crispr.shape[0]}; "
-            f"#(Genomic)={self.genomic.shape[0]}; "
-        )
-
         # Association files
         self.lmm_drug_crispr_file = f"{dpath}/drug_lmm_regressions_crispr.csv.gz"
         self.lmm_drug_gexp_file = f"{dpath}/drug_lmm_regressions_gexp.csv.gz"
@@ -86,16 +104,40 @@ class Association:
             f"{dpath}/drug_lmm_regressions_robust_genomic.csv.gz"
         )
 
+        # Association columnar stores, partitioned by drug
+        self.lmm_drug_crispr_store = f"{dpath}/drug_lmm_regressions_crispr.parquet"
+        self.lmm_drug_gexp_store = f"{dpath}/drug_lmm_regressions_gexp.parquet"
+        self.lmm_drug_genomic_store = f"{dpath}/drug_lmm_regressions_genomic.parquet"
+
+        self.lmm_robust_gexp_store = f"{dpath}/drug_lmm_regressions_robust_gexp.parquet"
+        self.lmm_robust_genomic_store = (
+            f"{dpath}/drug_lmm_regressions_robust_genomic.parquet"
+        )
+
         # Load associations
         if load_associations:
-            self.lmm_drug_crispr = pd.read_csv(self.lmm_drug_crispr_file)
-            self.lmm_drug_gexp = pd.read_csv(self.lmm_drug_gexp_file)
-            self.lmm_drug_genomic = pd.read_csv(self.lmm_drug_genomic_file)
+            self.lmm_drug_crispr = self.read_associations(
+                self.lmm_drug_crispr_store, self.lmm_drug_crispr_file
+            )
+            self.lmm_drug_gexp = self.read_associations(
+                self.lmm_drug_gexp_store, self.lmm_drug_gexp_file
+            )
+            self.lmm_drug_genomic = self.read_associations(
+                self.lmm_drug_genomic_store, self.lmm_drug_genomic_file
+            )
 
         # Load robust associations
         if load_robust:
-            self.lmm_robust_gexp = pd.read_csv(self.lmm_robust_gexp_file)
-            self.lmm_robust_genomic = pd.read_csv(self.lmm_robust_genomic_file)
+            self.lmm_robust_gexp = self.read_associations(
+                self.lmm_robust_gexp_store,
+                self.lmm_robust_gexp_file,
+                sort_cols=["drug_fdr", "drug_pval"],
+            )
+            self.lmm_robust_genomic = self.read_associations(
+                self.lmm_robust_genomic_store,
+                self.lmm_robust_genomic_file,
+                sort_cols=["drug_fdr", "drug_pval"],
+            )
 
         # Load PPI
         if load_ppi:
@@ -114,6 +156,103 @@ class Association:
                 sort=False,
             ).dropna()
 
+    # - Data-sets, imported on first access
+    @functools.cached_property
+    def crispr_obj(self):
+        return DataImporter.DataRegistry.get(DataImporter.CRISPR)
+
+    @functools.cached_property
+    def drespo_obj(self):
+        return DataImporter.DataRegistry.get(DataImporter.DrugResponse)
+
+    @functools.cached_property
+    def genomic_obj(self):
+        return DataImporter.DataRegistry.get(DataImporter.Genomic)
+
+    @functools.cached_property
+    def gexp_obj(self):
+        return DataImporter.DataRegistry.get(DataImporter.GeneExpression)
+
+    @functools.cached_property
+    def cn_obj(self):
+        return DataImporter.DataRegistry.get(DataImporter.CopyNumber)
+
+    @functools.cached_property
+    def samples(self):
+        # Sorted, so that data-sets and their fingerprints (DataImporter.DataFingerprint) are the same in every process
+        samples = sorted(
+            set.intersection(
+                set(self.drespo_obj.get_data(copy=False).columns),
+                set(self.crispr_obj.get_data(copy=False).columns),
+            )
+        )
+
+        logging.getLogger("DTrace").info(f"#(Samples)={len(samples)}")
+
+        return samples
+
+    @functools.cached_property
+    def ppi(self):
+        return DataImporter.PPI()
+
+    @functools.cached_property
+    def samplesheet(self):
+        return DataImporter.DataRegistry.get(DataImporter.Sample)
+
+    # - Data-sets filtered by samples
+    @functools.cached_property
+    def crispr(self):
+        crispr = self.crispr_obj.filter(subset=self.samples, scale=True)
+        logging.getLogger("DTrace").info(f"#(Genes)={crispr.shape[0]}")
+        return crispr
+
+    @functools.cached_property
+    def drespo(self):
+        drespo = self.drespo_obj.filter(subset=self.samples)
+        logging.getLogger("DTrace").info(f"#(Drugs)={drespo.shape[0]}")
+        return drespo
+
+    @functools.cached_property
+    def genomic(self):
+        genomic = self.genomic_obj.filter(subset=self.samples, min_events=5)
+        logging.getLogger("DTrace").info(f"#(Genomic)={genomic.shape[0]}")
+        return genomic
+
+    @functools.cached_property
+    def gexp(self):
+        return self.gexp_obj.filter(subset=self.samples)
+
+    @functools.cached_property
+    def cn(self):
+        return self.cn_obj.filter(subset=self.samples)
+
+    @staticmethod
+    def read_associations(
+        store_dir, csv_file, sort_cols=None, columns=None, drugs=None
+    ):
+        """
+        Read associations from a columnar store (see AssociationStore) if it exists, otherwise from the CSV file.
+
+        :param sort_cols: Associations are sorted by these columns, defaults to ["fdr", "pval"].
+        :param columns: Optional list of columns to load.
+        :param drugs: Optional list of DRUG_IDs to load.
+        :return: pandas DataFrame
+        """
+        sort_cols = ["fdr", "pval"] if sort_cols is None else sort_cols
+
+        store = AssociationStore(store_dir)
+
+        if store.exists():
+            df = store.read(columns=columns, drugs=drugs)
+
+        else:
+            df = pd.read_csv(csv_file, usecols=columns)
+
+            if drugs is not None:
+                df = df[df["DRUG_ID"].isin(drugs)]
+
+        return df.sort_values(sort_cols).reset_index(drop=True)
+
     def build_association_matrix(
         self, associations=None, index=None, columns=None, values=None
     ):
@@ -122,11 +261,13 @@ class Association:
         columns = "GeneSymbol" if columns is None else columns
         values = "beta" if values is None else values
 
-        assoc_matrix = pd.pivot_table(
-            associations, index=index, columns=columns, values=values
+        # Dense cube of the associations, built once per data-frame. Same as pandas.pivot_table, the matrix is
+        # copied as cube views are read-only
+        cube = AssociationCube.of(
+            associations, values, drug_cols=index, feature_col=columns
         )
 
-        return assoc_matrix
+        return cube.matrix(values, dropna=True).copy()
 
     def get_covariates(self):
         # CRISPR institute of origin PC
@@ -154,12 +295,23 @@ class Association:
         return K
 
     @staticmethod
-    def lmm_association_limix(
+    def kinship_factor(k, rank=None):
+        """
+        Same kinship as Association.kinship represented by the (optionally truncated) thin SVD of k, without forming
+        the samples x samples matrix.
+
+        :param k: pandas DataFrame (samples x features).
+        :param rank: Number of top components kept, None keeps all (exact).
+        :return: dtrace.LMMEngine.KinshipFactor
+        """
+        return KinshipFactor.from_features(k, rank=rank)
+
+    @staticmethod
+    def lmm_association_data(
         y,
         x,
         m=None,
         k=None,
-        lik="normal",
         transform_y="scale",
         transform_x="scale",
         filter_std=True,
@@ -188,162 +340,1136 @@ class Association:
         elif transform_x == "rank":
             X = X.rank(axis=1)
 
-        elif transform_x == "min_events":
-            X = X.loc[:, X.sum() >= min_events]
+        elif transform_x == "min_events":
+            X = X.loc[:, X.sum() >= min_events]
+
+        # Random effects matrix
+        if k is None:
+            K = None
+
+        elif k is False:
+            K = Association.kinship(x.loc[Y.index]).values
+
+        elif isinstance(k, KinshipFactor):
+            K = k.subset(Y.index)
+
+        else:
+            K = k.loc[Y.index, Y.index].values
+
+        # Covariates + Intercept
+        if m is not None:
+            m = m.loc[Y.index]
+            m = m.assign(intercept=1)
+
+            if filter_std:
+                m = m.loc[:, m.std() > 0]
+
+        return dict(x=X, y=Y, k=K, m=m)
+
+    @staticmethod
+    def lmm_association_limix(
+        y,
+        x,
+        m=None,
+        k=None,
+        lik="normal",
+        transform_y="scale",
+        transform_x="scale",
+        filter_std=True,
+        min_events=5,
+    ):
+        params = Association.lmm_association_data(
+            y=y,
+            x=x,
+            m=m,
+            k=k,
+            transform_y=transform_y,
+            transform_x=transform_x,
+            filter_std=filter_std,
+            min_events=min_events,
+        )
+
+        # Linear Mixed Model
+        lmm = scan(
+            params["x"],
+            params["y"],
+            K=(
+                params["k"].to_dense()
+                if isinstance(params["k"], KinshipFactor)
+                else params["k"]
+            ),
+            M=params["m"],
+            lik=lik,
+            verbose=False,
+        )
+
+        effect_sizes = lmm.effsizes["h2"].query("effect_type == 'candidate'")
+        effect_sizes = effect_sizes.set_index("test").drop(
+            columns=["trait", "effect_type"]
+        )
+
+        res = pd.concat([effect_sizes, lmm.stats["pv20"]], axis=1, sort=False)
+
+        return res, params
+
+    @staticmethod
+    def lmm_null_model(params, kinship_cache=None):
+        """
+        Native engine (dtrace.LMMEngine.LMMEngine) null model of the data returned by lmm_association_data.
+
+        """
+        return LMMEngine(
+            params["y"].iloc[:, 0].values,
+            m=None if params["m"] is None else params["m"].values,
+            qs=Association.lmm_kinship_qs(params, kinship_cache=kinship_cache),
+        )
+
+    @staticmethod
+    def lmm_kinship_qs(params, kinship_cache=None):
+        """
+        Economic eigendecomposition of the kinship of the data returned by lmm_association_data, None without
+        random effects.
+
+        """
+        if params["k"] is None:
+            qs = None
+
+        elif kinship_cache is not None:
+            qs = kinship_cache.get(params["y"].index)
+
+        elif isinstance(params["k"], KinshipFactor):
+            qs = params["k"].economic_qs()
+
+        else:
+            qs = LMMEngine.economic_qs(params["k"])
+
+        return qs
+
+    @staticmethod
+    def lmm_association_native(
+        y,
+        x,
+        m=None,
+        k=None,
+        transform_y="scale",
+        transform_x="scale",
+        filter_std=True,
+        min_events=5,
+        kinship_cache=None,
+        n_permutations=0,
+        permutation_batch=100,
+        permutation_seed=0,
+    ):
+        """
+        Same model as lmm_association_limix (normal likelihood) fitted with the native EMMAX/P3D engine: variance
+        components are estimated once under the null model and all features in x are tested with batched GLS.
+
+        :param kinship_cache: Optional dtrace.LMMEngine.KinshipCache of k, reused across drugs with the same samples.
+
+        :param n_permutations: If > 0, empirical p-values (pval_perm) and permutation-based FDR (fdr_perm) are
+            added, computed in batches of permutation_batch permutations (see LMMEngine.permutation_test).
+
+        """
+        params = Association.lmm_association_data(
+            y=y,
+            x=x,
+            m=m,
+            k=k,
+            transform_y=transform_y,
+            transform_x=transform_x,
+            filter_std=filter_std,
+            min_events=min_events,
+        )
+
+        lmm = Association.lmm_null_model(params, kinship_cache=kinship_cache)
+
+        res = lmm.scan(params["x"])
+
+        if n_permutations > 0:
+            pval_perm, fdr_perm = lmm.permutation_test(
+                params["x"],
+                n_permutations=n_permutations,
+                batch_size=permutation_batch,
+                seed=permutation_seed,
+            )
+
+            res = res.assign(pval_perm=pval_perm, fdr_perm=fdr_perm)
+
+        return res, params
+
+    @staticmethod
+    def lmm_association_prescreen(
+        y,
+        x,
+        m=None,
+        k=None,
+        lik="normal",
+        transform_y="scale",
+        transform_x="scale",
+        filter_std=True,
+        min_events=5,
+        screen_pval=1e-3,
+        kinship_cache=None,
+    ):
+        """
+        Two-stage association: all features in x are first tested with a score test under the null model of the
+        drug (dtrace.LMMEngine.LMMEngine.score_test), then features with score p-value < screen_pval are refitted
+        with the exact likelihood-ratio test of lmm_association_limix. Score p-values are conservative, they are not
+        smaller than the likelihood-ratio ones under the null model variance components.
+
+        :param screen_pval: Score test p-value threshold below which features are refitted.
+
+        :param kinship_cache: Optional dtrace.LMMEngine.KinshipCache of k, reused across drugs with the same samples.
+
+        :return: Same as lmm_association_limix with an extra column, pval_source, "lrt" for refitted features and
+            "score" otherwise
+        """
+        params = Association.lmm_association_data(
+            y=y,
+            x=x,
+            m=m,
+            k=k,
+            transform_y=transform_y,
+            transform_x=transform_x,
+            filter_std=filter_std,
+            min_events=min_events,
+        )
+
+        lmm = Association.lmm_null_model(params, kinship_cache=kinship_cache)
+
+        res = lmm.score_test(params["x"]).assign(pval_source="score")
+
+        candidates = list(res.loc[res["pv20"] < screen_pval, "effect_name"])
+
+        if len(candidates) > 0:
+            res_lrt, _ = Association.lmm_association_limix(
+                y=y,
+                x=x[candidates],
+                m=m,
+                k=k,
+                lik=lik,
+                transform_y=transform_y,
+                transform_x=transform_x,
+                filter_std=filter_std,
+                min_events=min_events,
+            )
+
+            res = res.set_index("effect_name")
+
+            res_lrt = res_lrt.set_index("effect_name")[
+                ["effsize", "effsize_se", "pv20"]
+            ].assign(pval_source="lrt")
+
+            res.loc[res_lrt.index, res_lrt.columns] = res_lrt
+
+            res = res.reset_index()
+
+        return res, params
+
+    @staticmethod
+    def missing_patterns(y):
+        """
+        Group the columns of y (e.g. drugs) by their pattern of non-missing samples, largest groups first.
+
+        :param y: pandas DataFrame (samples x traits).
+        :return: list of lists of columns
+        """
+        masks = y.notna().T
+
+        groups = {}
+        for c, mask in zip(masks.index, masks.values):
+            groups.setdefault(mask.tobytes(), []).append(c)
+
+        return sorted(groups.values(), key=len, reverse=True)
+
+    @staticmethod
+    def lmm_single_association_batch(
+        y,
+        x,
+        m=None,
+        k=None,
+        engine="limix",
+        kinship_cache_size=8,
+        n_jobs=1,
+        chunk_size=16,
+        checkpoint=None,
+        fingerprints=None,
+        fdr_method=None,
+        callback=None,
+        verbose=0,
+        **kwargs,
+    ):
+        """
+        Run lmm_single_association for every column of y. Columns are dispatched grouped by their pattern of missing
+        samples so the native engine decomposes each distinct K submatrix only once.
+
+        :param engine: LMM implementation, "limix" or "native" (see lmm_single_association).
+
+        :param kinship_cache_size: Number of kinship eigendecompositions kept in memory (per process) by the native
+            engine.
+
+        :param n_jobs: Number of worker processes. Chunks of chunk_size columns are sent to a process pool whose
+            workers receive x, k and m only once. Results are identical to the serial run (n_jobs=1).
+
+        :param checkpoint: Optional dtrace.AssociationsCheckpoint.AssociationCheckpoint. Columns already tested are
+            loaded instead of refitted and new results are persisted as each chunk completes.
+
+        :param fingerprints: Optional dict of column -> fingerprint of its inputs (see DataImporter.DataFingerprint).
+            Checkpointed columns are only reused if their fingerprint is unchanged.
+
+        :param fdr_method: If not None, multiple testing correction (multipletests_per_drug) is applied to each
+            column as it completes, so that checkpointed results reused in later runs are not corrected again.
+
+        :param callback: Optional function called with (column, data-frame) as each column completes (and for the
+            columns resumed from the checkpoint). Results are then handed over and not kept in memory.
+
+        :param kwargs: Extra arguments of lmm_single_association (e.g. transform_x, expand_id).
+
+        :return: list of data-frames, one per column of y and in the same order, None if callback is given
+        """
+        res = {} if checkpoint is None else checkpoint.resume(list(y), fingerprints)
+
+        if callback is not None:
+            for c in res:
+                callback(c, res[c])
+                res[c] = None
+
+        def collect(chunk, chunk_res):
+            for c, c_res in zip(chunk, chunk_res):
+                if fdr_method is not None:
+                    c_res = Association.multipletests_per_drug(
+                        c_res,
+                        method=fdr_method,
+                        index_cols=None if kwargs.get("expand_id", True) else ["Y_ID"],
+                    )
+
+                if checkpoint is not None:
+                    checkpoint.save(
+                        c, c_res, None if fingerprints is None else fingerprints[c]
+                    )
+
+                if callback is not None:
+                    callback(c, c_res)
+                    c_res = None
+
+                res[c] = c_res
+
+        columns = [
+            c
+            for c_group in Association.missing_patterns(y)
+            for c in c_group
+            if c not in res
+        ]
+
+        chunks = [
+            columns[i : i + chunk_size] for i in range(0, len(columns), chunk_size)
+        ]
+
+        if n_jobs == 1:
+            _lmm_worker_init(x, k, m, engine, kinship_cache_size)
+
+            try:
+                for chunk in chunks:
+                    chunk_kws = dict(verbose=verbose, **kwargs)
+                    collect(chunk, _lmm_worker_chunk(y[chunk], chunk_kws))
+
+                kinship_cache = _LMM_WORKER["kinship_cache"]
+
+                if (kinship_cache is not None) and (kinship_cache.misses > 0):
+                    logging.getLogger("DTrace").info(
+                        f"Kinship decompositions={kinship_cache.misses}; reused={kinship_cache.hits}"
+                    )
+
+            finally:
+                _LMM_WORKER.clear()
+
+        else:
+            with ProcessPoolExecutor(
+                max_workers=n_jobs,
+                initializer=_lmm_worker_init,
+                initargs=(x, k, m, engine, kinship_cache_size),
+            ) as executor:
+                futures = {
+                    executor.submit(
+                        _lmm_worker_chunk, y[chunk], dict(verbose=0, **kwargs)
+                    ): chunk
+                    for chunk in chunks
+                }
+
+                for i, future in enumerate(as_completed(futures)):
+                    collect(futures[future], future.result())
+
+                    if verbose:
+                        logging.getLogger("DTrace").info(
+                            f"[lmm_single_association_batch] {len(res)}/{y.shape[1]} done "
+                            f"(chunk {i + 1}/{len(chunks)})"
+                        )
+
+        if callback is not None:
+            return None
+
+        return [res[c] for c in y]
+
+    @staticmethod
+    def lmm_single_association(
+        y,
+        x,
+        m=None,
+        k=None,
+        expand_id=True,
+        lik="normal",
+        transform_y="scale",
+        transform_x="scale",
+        filter_std=True,
+        engine="limix",
+        kinship_cache=None,
+        screen_pval=None,
+        verbose=0,
+        **kwargs,
+    ):
+        """
+        :param engine: LMM implementation, "limix" (limix.qtl.scan) or "native" (dtrace.LMMEngine, EMMAX/P3D).
+
+        :param kinship_cache: Shared kinship eigendecompositions (dtrace.LMMEngine.KinshipCache), used by the native
+            engine and the score test prescreen.
+
+        :param screen_pval: LIMIX engine only. If not None, features are prescreened with a score test and only those
+            with p-value < screen_pval are refitted with limix (see lmm_association_prescreen).
+
+        :param kwargs: Extra arguments of lmm_association_native (e.g. n_permutations), native engine only.
+
+        """
+        y_id = y.columns[0]
+
+        if verbose:
+            v_label = (
+                f"Drug {y_id[1]} from screen {y_id[2]} with ID {y_id[0]}"
+                if expand_id
+                else y_id
+            )
+            logging.getLogger("DTrace").info(f"[lmm_single_association] {v_label}")
+
+        if engine == "native":
+            res, params = Association.lmm_association_native(
+                y=y,
+                x=x,
+                m=m,
+                k=k,
+                transform_y=transform_y,
+                transform_x=transform_x,
+                filter_std=filter_std,
+                kinship_cache=kinship_cache,
+                **kwargs,
+            )
+
+        elif screen_pval is not None:
+            res, params = Association.lmm_association_prescreen(
+                y=y,
+                x=x,
+                m=m,
+                k=k,
+                lik=lik,
+                transform_y=transform_y,
+                transform_x=transform_x,
+                filter_std=filter_std,
+                screen_pval=screen_pval,
+                kinship_cache=kinship_cache,
+            )
+
+        else:
+            res, params = Association.lmm_association_limix(
+                y=y,
+                x=x,
+                m=m,
+                k=k,
+                lik=lik,
+                transform_y=transform_y,
+                transform_x=transform_x,
+                filter_std=filter_std,
+            )
+
+        return Association.lmm_association_format(res, y_id, params, expand_id)
+
+    @staticmethod
+    def lmm_association_format(res, y_id, params, expand_id=True):
+        cols_rename = dict(
+            effect_name="GeneSymbol", pv20="pval", effsize="beta", effsize_se="beta_se"
+        )
+
+        res = res.reset_index(drop=True).rename(columns=cols_rename)
+
+        if expand_id:
+            res = res.assign(DRUG_ID=y_id[0])
+            res = res.assign(DRUG_NAME=y_id[1])
+            res = res.assign(VERSION=y_id[2])
+
+        else:
+            res = res.assign(Y_ID=y_id)
+
+        res = res.assign(samples=params["y"].shape[0])
+        res = res.assign(ncovariates=0 if params["m"] is None else params["m"].shape[1])
+
+        return res
+
+    @staticmethod
+    def linear_single_association_batch(
+        y,
+        x,
+        m=None,
+        transform_y="scale",
+        transform_x="scale",
+        filter_std=True,
+        expand_id=True,
+        fdr_method=None,
+        callback=None,
+        verbose=0,
+    ):
+        """
+        Fixed effects only counterpart of lmm_single_association_batch (k=None). Columns of y sharing the same
+        samples are fitted together with closed-form linear models (dtrace.LMMEngine.ols_scan), i.e. all traits x
+        all features in a few matrix products. Returns the same statistics as lmm_single_association.
+
+        :param callback: Optional function called with (column, data-frame) as each column completes, see
+            lmm_single_association_batch.
+
+        :return: list of data-frames, one per column of y and in the same order, None if callback is given
+        """
+        res = {}
+
+        for c_group in Association.missing_patterns(y):
+            params = Association.lmm_association_data(
+                y=y[c_group],
+                x=x,
+                m=m,
+                k=None,
+                transform_y=transform_y,
+                transform_x=transform_x,
+                filter_std=filter_std,
+            )
+
+            lm = LMMEngine.ols_scan(
+                params["y"].values,
+                params["x"].values,
+                None if params["m"] is None else params["m"].values,
+            )
+
+            for i, c in enumerate(c_group):
+                c_res = pd.DataFrame(
+                    dict(
+                        effect_name=params["x"].columns,
+                        effsize=lm["effsize"][:, i],
+                        effsize_se=lm["effsize_se"][:, i],
+                        pv20=lm["pv20"][:, i],
+                    )
+                )
+
+                c_res = Association.lmm_association_format(c_res, c, params, expand_id)
+
+                if fdr_method is not None:
+                    c_res = Association.multipletests_per_drug(
+                        c_res,
+                        method=fdr_method,
+                        index_cols=None if expand_id else ["Y_ID"],
+                    )
+
+                if callback is not None:
+                    callback(c, c_res)
+                    c_res = None
+
+                res[c] = c_res
+
+            if verbose:
+                logging.getLogger("DTrace").info(
+                    f"[linear_single_association_batch] {len(res)}/{y.shape[1]} done"
+                )
+
+        if callback is not None:
+            return None
+
+        return [res[c] for c in y]
+
+    def lmm_single_data(
+        self,
+        x_dtype="crispr",
+        add_covariates=True,
+        add_random_effects=True,
+        low_rank_kinship=False,
+        kinship_rank=None,
+    ):
+        """
+        Drug response (y), features (x), kinship (k) and covariates (m) of the single feature associations with
+        x_dtype (see lmm_single_associations).
+
+        :return: Tuple (y, x, k, m)
+        """
+        # - Samples
+        if x_dtype == "gexp":
+            samples = list(self.gexp)
+
+        elif x_dtype == "genomic":
+            samples = list(self.genomic)
+
+        else:
+            samples = self.samples
+
+        # - y
+        y = self.drespo[samples].T
+
+        # - x
+        if x_dtype == "gexp":
+            x = self.gexp[samples].T
+
+        elif x_dtype == "genomic":
+            x = self.genomic[samples].T
+
+        else:
+            x = self.crispr[samples].T
+
+        # - Kinship matrix (random effects)
+        if not add_random_effects:
+            k = None
+
+        elif low_rank_kinship:
+            k = self.kinship_factor(x, rank=kinship_rank)
+
+        else:
+            k = self.kinship(x).loc[samples, samples]
+
+        # - Covariates
+        m = self.get_covariates().loc[samples] if add_covariates else None
+
+        return y, x, k, m
+
+    def lmm_single_associations(
+        self,
+        add_covariates=True,
+        add_random_effects=True,
+        x_dtype="crispr",
+        engine="limix",
+        kinship_cache_size=8,
+        low_rank_kinship=False,
+        kinship_rank=None,
+        n_jobs=1,
+        chunk_size=16,
+        run_dir=None,
+        store_dir=None,
+        n_permutations=0,
+        permutation_batch=100,
+        permutation_seed=0,
+        screen_pval=None,
+        verbose=0,
+    ):
+        """
+        :param engine: LMM implementation, "limix" or "native" (see lmm_single_association). With
+            add_random_effects=False (and no permutations or prescreen) both engines fit the same fixed effects model,
+            so all drugs are fitted with closed-form linear models instead (see linear_single_association_batch),
+            which takes seconds; run_dir and n_jobs are then not used.
+
+        :param kinship_cache_size: Number of kinship eigendecompositions kept in memory by the native engine. Drugs
+            are dispatched grouped by their pattern of missing measurements so each distinct K submatrix is
+            decomposed only once.
+
+        :param low_rank_kinship: Represent K by the thin SVD of x (Association.kinship_factor) instead of the dense
+            samples x samples matrix, native engine only.
+
+        :param kinship_rank: Number of top components of the low-rank kinship, None keeps all (exact).
+
+        :param n_jobs: Number of worker processes, drugs are sent in chunks of chunk_size (see
+            lmm_single_association_batch).
+
+        :param run_dir: Optional directory where the associations of each drug are persisted as soon as they are
+            tested. Re-running with the same run_dir skips the drugs already finished, before assembling and
+            correcting the final table. Each drug is stored with the fingerprint of its inputs (drug measurements,
+            x, k, covariates and parameters), so only drugs whose inputs changed (e.g. new release) are tested and
+            FDR corrected again.
+
+        :param store_dir: Optional directory of a columnar store (AssociationStore) where the annotated associations
+            of each drug are written as soon as they are tested, instead of assembling the full table in memory.
+
+        :param n_permutations: Native engine only. If > 0, each drug is permuted n_permutations times in the
+            whitened space of its null model, in batches of permutation_batch, and the empirical p-values (pval_perm)
+            and permutation-based FDR per drug (fdr_perm) are reported alongside pval and fdr.
+
+        :param screen_pval: LIMIX engine only. If not None, all pairs are tested with a score test under the null
+            model of each drug and only pairs with p-value < screen_pval are refitted with the exact LIMIX
+            likelihood-ratio test. The pval_source column reports the test of each p-value ("score" or "lrt").
+
+        :return: pandas DataFrame sorted by fdr and pval, or the AssociationStore if store_dir is given
+
+        """
+        if (n_permutations > 0) and (engine != "native"):
+            raise ValueError("Permutations are only supported by the native engine")
+
+        if (screen_pval is not None) and (engine != "limix"):
+            raise ValueError(
+                "Score test prescreen is only supported by the limix engine"
+            )
+
+        y, x, k, m = self.lmm_single_data(
+            x_dtype=x_dtype,
+            add_covariates=add_covariates,
+            add_random_effects=add_random_effects,
+            low_rank_kinship=low_rank_kinship,
+            kinship_rank=kinship_rank,
+        )
+
+        # - Checkpoint
+        checkpoint, fingerprints = None, None
+
+        if run_dir is not None:
+            params = dict(
+                x_dtype=x_dtype,
+                engine=engine,
+                add_covariates=add_covariates,
+                add_random_effects=add_random_effects,
+                low_rank_kinship=low_rank_kinship,
+                kinship_rank=kinship_rank,
+            )
+
+            if n_permutations > 0:
+                params.update(
+                    n_permutations=n_permutations, permutation_seed=permutation_seed
+                )
+
+            if screen_pval is not None:
+                params.update(screen_pval=screen_pval)
+
+            checkpoint = AssociationCheckpoint(run_dir, params=params)
+
+            # Low-rank kinship is fully determined by x and the parameters
+            fp_k = None if low_rank_kinship else k
+            fp_inputs = DataImporter.DataFingerprint.hash(x, fp_k, m, params)
+            fingerprints = {
+                d: DataImporter.DataFingerprint.hash(y[d], fp_inputs, self.pval_method)
+                for d in y
+            }
+
+        # - Single feature linear mixed regression
+        # Association and multiple p-value correction (per drug)
+        engine_kws = (
+            dict(
+                n_permutations=n_permutations,
+                permutation_batch=permutation_batch,
+                permutation_seed=permutation_seed,
+            )
+            if n_permutations > 0
+            else dict()
+        )
+
+        if screen_pval is not None:
+            engine_kws.update(screen_pval=screen_pval)
+
+        # - PPI network built once for all drugs
+        ppi = (
+            self.ppi.build_string_ppi(score_thres=900) if x_dtype != "genomic" else None
+        )
+
+        def annotate(df):
+            # Annotate drug target
+            df = self.annotate_drug_target(df)
+
+            # Annotate association distance to target
+            if x_dtype != "genomic":
+                df = self.ppi.ppi_annotation(
+                    df, ppi_type="string", ppi_kws=None, target_thres=5, ppi=ppi
+                )
+
+            # X data type
+            df = df.assign(x_dtype=x_dtype)
+
+            # Model settings, checked when the associations are reused (see lmm_robust_associations)
+            df.attrs[self.LMM_PARAMS_ATTR] = dict(
+                x_dtype=x_dtype,
+                engine=engine,
+                add_covariates=add_covariates,
+                add_random_effects=add_random_effects,
+            )
+
+            return df
+
+        # Drugs are annotated and written to the store as they complete
+        store = None if store_dir is None else AssociationStore(store_dir)
+
+        callback = (
+            None if store is None else (lambda d, d_res: store.write(annotate(d_res)))
+        )
+
+        if (k is None) and (n_permutations == 0) and (screen_pval is None):
+            lmm_single = self.linear_single_association_batch(
+                y,
+                x,
+                m=m,
+                transform_x="scale" if x_dtype != "genomic" else "min_events",
+                fdr_method=self.pval_method,
+                callback=callback,
+                verbose=verbose,
+            )
+
+        else:
+            lmm_single = self.lmm_single_association_batch(
+                y,
+                x,
+                k=k,
+                m=m,
+                transform_x="scale" if x_dtype != "genomic" else "min_events",
+                engine=engine,
+                kinship_cache_size=kinship_cache_size,
+                n_jobs=n_jobs,
+                chunk_size=chunk_size,
+                checkpoint=checkpoint,
+                fingerprints=fingerprints,
+                fdr_method=self.pval_method,
+                callback=callback,
+                verbose=verbose,
+                **engine_kws,
+            )
+
+        if store is not None:
+            return store
+
+        lmm_single = annotate(pd.concat(lmm_single, ignore_index=True))
+
+        # Sort p-values
+        lmm_single = lmm_single.sort_values(["fdr", "pval"])
+
+        return lmm_single
+
+    def lmm_joint_associations(
+        self,
+        x_dtype="crispr",
+        add_covariates=True,
+        add_random_effects=True,
+        screens=("GDSC1", "GDSC2"),
+        block_size=1000,
+        kinship_cache_size=8,
+        verbose=0,
+    ):
+        """
+        Joint associations of compounds screened in both GDSC1 and GDSC2 (same DRUG_NAME): the responses of the two
+        screens are fitted together against each feature (dtrace.LMMEngine.MultiTraitLMMEngine), on the samples
+        measured in both, with the same x, kinship and covariates as lmm_single_associations.
+
+        :param screens: Versions (VERSION) of the two screens.
+        :param block_size: Number of features tested at once.
+        :return: pandas DataFrame with the shared effect of both screens (beta, beta_se, pval and fdr per compound),
+            the effect in each screen (beta_GDSC1, beta_se_GDSC1, beta_GDSC2 and beta_se_GDSC2), the test of any
+            effect (pval_joint) and the test of different effects between screens (pval_het)
+        """
+        y, x, k, m = self.lmm_single_data(
+            x_dtype=x_dtype,
+            add_covariates=add_covariates,
+            add_random_effects=add_random_effects,
+        )
+
+        # - Compounds screened in both versions
+        pairs = [
+            (d1, d2)
+            for d1 in y
+            if d1[2] == screens[0]
+            for d2 in y
+            if (d2[2] == screens[1]) and (d2[1] == d1[1])
+        ]
+
+        kinship_cache = (
+            None if k is None else KinshipCache(k, maxsize=kinship_cache_size)
+        )
+
+        cols_rename = dict(
+            effect_name="GeneSymbol",
+            effsize="beta",
+            effsize_se="beta_se",
+            pv20="pval",
+            effsize_t1=f"beta_{screens[0]}",
+            effsize_se_t1=f"beta_se_{screens[0]}",
+            effsize_t2=f"beta_{screens[1]}",
+            effsize_se_t2=f"beta_se_{screens[1]}",
+            pv_joint="pval_joint",
+            pv_het="pval_het",
+        )
+
+        res = []
+
+        for d1, d2 in pairs:
+            if verbose > 0:
+                logging.getLogger("DTrace").info(
+                    f"[lmm_joint_associations] Drug {d1[1]} with IDs {d1[0]} and {d2[0]}"
+                )
+
+            params = Association.lmm_association_data(
+                y=y[[d1, d2]],
+                x=x,
+                m=m,
+                k=k,
+                transform_x="scale" if x_dtype != "genomic" else "min_events",
+            )
+
+            lmm = MultiTraitLMMEngine(
+                params["y"].values,
+                m=None if params["m"] is None else params["m"].values,
+                qs=Association.lmm_kinship_qs(params, kinship_cache=kinship_cache),
+            )
+
+            d_res = lmm.scan(params["x"], block_size=block_size).rename(
+                columns=cols_rename
+            )
+
+            d_res.insert(0, "DRUG_NAME", d1[1])
+            d_res.insert(1, f"DRUG_ID_{screens[0]}", d1[0])
+            d_res.insert(2, f"DRUG_ID_{screens[1]}", d2[0])
+
+            d_res = d_res.assign(samples=params["y"].shape[0])
+            d_res = d_res.assign(
+                ncovariates=0 if params["m"] is None else params["m"].shape[1]
+            )
+
+            res.append(d_res)
+
+        lmm_joint = pd.concat(res, ignore_index=True)
+
+        # Multiple p-value correction (per compound)
+        lmm_joint = self.multipletests_per_drug(
+            lmm_joint,
+            index_cols=["DRUG_NAME"] + [f"DRUG_ID_{s}" for s in screens],
+            method=self.pval_method,
+        )
+
+        # X data type
+        lmm_joint = lmm_joint.assign(x_dtype=x_dtype)
+
+        return lmm_joint.sort_values(["fdr", "pval"])
+
+    def lmm_multiomics_data(self, x_dtypes=None, dropna_features=False):
+        """
+        Features of each data type tested by lmm_multiomics_associations: "crispr", "gexp", "genomic", "cn" (copy
+        number), "wes" (binary WES variants per gene, DataImporter.WES) and "rnai" (DataImporter.RNAi). Samples
+        without measurements are dropped.
+
+        :param dropna_features: Drop features with missing values (logged per data type), otherwise these are kept
+            and tested on the samples where they are measured.
+
+        :return: dict of x_dtype -> pandas DataFrame (samples x features), samples ordered as in self.samples
+        """
+        x_dtypes = self.MULTIOMICS_DTYPES if x_dtypes is None else x_dtypes
+
+        xs = {}
+
+        for x_dtype in x_dtypes:
+            if x_dtype == "crispr":
+                x = self.crispr
+
+            elif x_dtype == "gexp":
+                x = self.gexp
+
+            elif x_dtype == "genomic":
+                x = self.genomic
+
+            elif x_dtype == "cn":
+                x = self.cn
+
+            elif x_dtype == "wes":
+                x = DataImporter.DataRegistry.get(DataImporter.WES).filter(
+                    subset=self.samples, as_matrix=True
+                )
+
+            elif x_dtype == "rnai":
+                x = DataImporter.DataRegistry.get(DataImporter.RNAi).filter(
+                    subset=self.samples
+                )
+
+            else:
+                raise ValueError(
+                    f"x_dtype {x_dtype} not supported, choose from: {self.MULTIOMICS_DTYPES}"
+                )
+
+            x = x.dropna(how="all", axis=1).dropna(how="all")
+
+            if dropna_features:
+                n_features = x.shape[0]
+                x = x.dropna()
+
+                logging.getLogger("DTrace").info(
+                    f"[lmm_multiomics_data] {x_dtype}: {n_features - x.shape[0]} features with missing values "
+                    f"dropped, {x.shape[0]} kept"
+                )
+
+            xs[x_dtype] = x[[s for s in self.samples if s in x.columns]].T
+
+        return xs
+
+    def lmm_multiomics_associations(
+        self,
+        x_dtypes=None,
+        add_covariates=True,
+        add_random_effects=True,
+        kinship_dtype=None,
+        dropna_features=False,
+        store_dir=None,
+        kinship_cache_size=8,
+        verbose=0,
+    ):
+        """
+        Single pass of the drugs over several data types (see lmm_multiomics_data) with the native engine. All data
+        types share the covariates and, as in lmm_single_associations, each data type uses its own kinship. The null
+        model of a drug is fitted once per distinct kinship and set of samples, and reused by every scan with the
+        same ones (e.g. all data types without random effects, or features with the same missing samples).
+
+        :param x_dtypes: Data types tested, defaults to Association.MULTIOMICS_DTYPES.
 
-        # Random effects matrix
-        if k is None:
-            K = None
+        :param kinship_dtype: Optional data type (e.g. "crispr") whose kinship is used by all data types, so that the
+            null models are shared across data types. Note this changes the model of the other data types compared
+            with lmm_single_associations. Samples not measured in kinship_dtype are not tested.
 
-        elif k is False:
-            K = Association.kinship(x.loc[Y.index]).values
+        :param dropna_features: Drop features with missing values (see lmm_multiomics_data). Otherwise features are
+            grouped by their pattern of missing samples and each group is tested on the samples where it is measured.
 
-        else:
-            K = k.loc[Y.index, Y.index].values
+        :param store_dir: Optional directory of a columnar store (AssociationStore) where the associations of each
+            drug are written as soon as they are tested, partitioned by data type (x_dtype=.../), each partition
+            readable as an AssociationStore.
 
-        # Covariates + Intercept
-        if m is not None:
-            m = m.loc[Y.index]
-            m = m.assign(intercept=1)
+        :return: dict of x_dtype -> pandas DataFrame, same columns as lmm_single_associations
+        """
+        xs = self.lmm_multiomics_data(x_dtypes, dropna_features=dropna_features)
 
-            if filter_std:
-                m = m.loc[:, m.std() > 0]
+        # - Drug response and covariates, shared by all data types
+        y = self.drespo[self.samples].T
 
-        # Linear Mixed Model
-        lmm = scan(X, Y, K=K, M=m, lik=lik, verbose=False)
+        m = self.get_covariates().loc[self.samples] if add_covariates else None
 
-        return lmm, dict(x=X, y=Y, k=K, m=m)
+        # - Kinship of each data type, from the features measured in all its samples
+        k_dtypes = {
+            x_dtype: (
+                None
+                if not add_random_effects
+                else (x_dtype if kinship_dtype is None else kinship_dtype)
+            )
+            for x_dtype in xs
+        }
 
-    @staticmethod
-    def lmm_single_association(
-        y,
-        x,
-        m=None,
-        k=None,
-        expand_id=True,
-        lik="normal",
-        transform_y="scale",
-        transform_x="scale",
-        filter_std=True,
-        verbose=0,
-    ):
-        cols_rename = dict(
-            effect_name="GeneSymbol", pv20="pval", effsize="beta", effsize_se="beta_se"
-        )
+        kinship_caches = {}
 
-        y_id = y.columns[0]
+        for k_dtype in set(k_dtypes.values()) - {None}:
+            k_x = (
+                xs[k_dtype]
+                if k_dtype in xs
+                else self.lmm_multiomics_data([k_dtype])[k_dtype]
+            )
 
-        if verbose:
-            v_label = (
-                f"Drug {y_id[1]} from screen {y_id[2]} with ID {y_id[0]}"
-                if expand_id
-                else y_id
+            kinship_caches[k_dtype] = KinshipCache(
+                self.kinship(k_x.dropna(axis=1)), maxsize=kinship_cache_size
             )
-            logging.getLogger("DTrace").info(f"[lmm_single_association] {v_label}")
 
-        lmm, params = Association.lmm_association_limix(
-            y=y,
-            x=x,
-            m=m,
-            k=k,
-            lik=lik,
-            transform_y=transform_y,
-            transform_x=transform_x,
-            filter_std=filter_std,
-        )
+        # - Features grouped by their measured samples (within the samples of the kinship)
+        x_groups = {}
 
-        effect_sizes = lmm.effsizes["h2"].query("effect_type == 'candidate'")
-        effect_sizes = effect_sizes.set_index("test").drop(
-            columns=["trait", "effect_type"]
-        )
+        for x_dtype, x in xs.items():
+            k_dtype = k_dtypes[x_dtype]
 
-        pvalues = lmm.stats["pv20"]
+            if k_dtype is not None:
+                x = x.loc[x.index.isin(kinship_caches[k_dtype].k.index)]
 
-        res = pd.concat([effect_sizes, pvalues], axis=1, sort=False)
-        res = res.reset_index(drop=True).rename(columns=cols_rename)
+            x_groups[x_dtype] = [
+                (x.index[x[features[0]].notna().values], features)
+                for features in self.missing_patterns(x)
+            ]
 
-        if expand_id:
-            res = res.assign(DRUG_ID=y_id[0])
-            res = res.assign(DRUG_NAME=y_id[1])
-            res = res.assign(VERSION=y_id[2])
+            if len(x_groups[x_dtype]) > 1:
+                logging.getLogger("DTrace").info(
+                    f"[lmm_multiomics_associations] {x_dtype}: {len(x_groups[x_dtype])} patterns of missing samples"
+                )
 
-        else:
-            res = res.assign(Y_ID=y_id)
+        store = (
+            None
+            if store_dir is None
+            else AssociationStore(
+                store_dir, partition_cols=["x_dtype"] + AssociationStore.PARTITION_COLS
+            )
+        )
 
-        res = res.assign(samples=params["y"].shape[0])
-        res = res.assign(ncovariates=0 if m is None else params["m"].shape[1])
+        # - PPI network built once for all drugs
+        ppi = (
+            self.ppi.build_string_ppi(score_thres=900)
+            if any(x_dtype != "genomic" for x_dtype in xs)
+            else None
+        )
 
-        return res
+        res = {x_dtype: [] for x_dtype in xs}
+        n_nulls, n_scans = 0, 0
 
-    def lmm_single_associations(
-        self, add_covariates=True, add_random_effects=True, x_dtype="crispr", verbose=0
-    ):
-        # - Samples
-        if x_dtype == "gexp":
-            samples = list(self.gexp)
+        for i, d in enumerate(y):
+            nulls = {}
 
-        elif x_dtype == "genomic":
-            samples = list(self.genomic)
+            for x_dtype, x in xs.items():
+                k_dtype = k_dtypes[x_dtype]
+                kinship_cache = kinship_caches.get(k_dtype)
 
-        else:
-            samples = self.samples
+                x_res = []
 
-        # - y
-        y = self.drespo[samples].T
+                for samples, features in x_groups[x_dtype]:
+                    # Kinship decompositions are taken from the cache by samples, K is not subset here
+                    params = self.lmm_association_data(
+                        y=y[[d]].reindex(samples),
+                        x=x.loc[samples, features],
+                        m=m,
+                        transform_x=(
+                            "min_events" if x_dtype in ["genomic", "wes"] else "scale"
+                        ),
+                    )
 
-        # - x
-        if x_dtype == "gexp":
-            x = self.gexp[samples].T
+                    null_key = (k_dtype, tuple(params["y"].index))
 
-        elif x_dtype == "genomic":
-            x = self.genomic[samples].T
+                    if null_key not in nulls:
+                        nulls[null_key] = LMMEngine(
+                            params["y"].iloc[:, 0].values,
+                            m=None if params["m"] is None else params["m"].values,
+                            qs=(
+                                None
+                                if kinship_cache is None
+                                else kinship_cache.get(params["y"].index)
+                            ),
+                        )
 
-        else:
-            x = self.crispr[samples].T
+                    x_res.append(
+                        self.lmm_association_format(
+                            nulls[null_key].scan(params["x"]), d, params
+                        )
+                    )
 
-        # - Kinship matrix (random effects)
-        k = self.kinship(x).loc[samples, samples] if add_random_effects else None
+                n_scans += len(x_res)
 
-        # - Covariates
-        m = self.get_covariates().loc[samples] if add_covariates else None
+                x_res = pd.concat(x_res, ignore_index=True)
 
-        # - Single feature linear mixed regression
-        # Association
-        lmm_single = pd.concat(
-            [
-                self.lmm_single_association(
-                    y[[d]],
-                    x,
-                    k=k,
-                    m=m,
-                    transform_x="scale" if x_dtype != "genomic" else "min_events",
-                    verbose=verbose,
-                )
-                for d in y
-            ]
-        )
+                x_res = self.multipletests_per_drug(x_res, method=self.pval_method)
 
-        # Multiple p-value correction
-        lmm_single = self.multipletests_per_drug(
-            lmm_single, field="pval", method=self.pval_method
-        )
+                x_res = self.annotate_drug_target(x_res)
 
-        # Annotate drug target
-        lmm_single = self.annotate_drug_target(lmm_single)
+                if x_dtype != "genomic":
+                    x_res = self.ppi.ppi_annotation(
+                        x_res,
+                        ppi_type="string",
+                        ppi_kws=dict(score_thres=900),
+                        target_thres=5,
+                        ppi=ppi,
+                    )
 
-        # Annotate association distance to target
-        if x_dtype != "genomic":
-            lmm_single = self.ppi.ppi_annotation(
-                lmm_single, ppi_type="string", ppi_kws=dict(score_thres=900), target_thres=5
-            )
+                res[x_dtype].append(x_res.assign(x_dtype=x_dtype))
 
-        # X data type
-        lmm_single = lmm_single.assign(x_dtype=x_dtype)
+            n_nulls += len(nulls)
 
-        # Sort p-values
-        lmm_single = lmm_single.sort_values(["fdr", "pval"])
+            if store is not None:
+                store.write([res[x_dtype][-1] for x_dtype in xs])
 
-        return lmm_single
+            if verbose:
+                logging.getLogger("DTrace").info(
+                    f"[lmm_multiomics_associations] {i + 1}/{y.shape[1]} drugs done; "
+                    f"null models={n_nulls}, scans={n_scans}"
+                )
+
+        return {
+            x_dtype: pd.concat(res[x_dtype], ignore_index=True).sort_values(
+                ["fdr", "pval"]
+            )
+            for x_dtype in xs
+        }
 
     def lmm_robust_associations(
         self,
@@ -352,8 +1478,30 @@ class Association:
         add_random_effects=True,
         x_dtype="genomic",
         fdr_thres=0.1,
+        engine="limix",
+        n_jobs=1,
+        chunk_size=16,
+        lmm_drug=None,
+        crispr_cache_dir=None,
         verbose=0,
     ):
+        """
+        :param engine: LMM implementation, "limix" or "native" (see lmm_single_association).
+
+        :param n_jobs: Number of worker processes used for both the drug and the CRISPR gene scans (see
+            lmm_single_association_batch).
+
+        :param lmm_drug: Optional drug ~ x_dtype associations from lmm_single_associations(x_dtype=x_dtype), fitted
+            with the same add_covariates, add_random_effects and engine as this call. The settings recorded with the
+            associations (also kept by AssociationStore) are checked and a ValueError is raised if they differ. Only
+            drugs missing from these are fitted. If None, all drugs are fitted.
+
+        :param crispr_cache_dir: Optional directory of a persistent CRISPR gene ~ x_dtype association cache (see
+            dtrace.AssociationsCheckpoint). Genes already fitted with the same inputs are loaded and only the
+            missing genes are fitted, so the robust associations can be recomputed for a new fdr_thres without new
+            regressions.
+
+        """
         if verbose > 0:
             logging.getLogger("DTrace").info(f"Robust associations with {x_dtype}")
 
@@ -369,9 +1517,38 @@ class Association:
         else:
             samples = list(self.genomic)
 
+        # - Drug associations already tested by lmm_single_associations
+        lmm_drug_cols = self.dcols + [
+            "x_feature",
+            "beta",
+            "beta_se",
+            "pval",
+            "samples",
+            "ncovariates",
+        ]
+
+        if lmm_drug is not None:
+            self.check_lmm_params(
+                lmm_drug,
+                x_dtype=x_dtype,
+                engine=engine,
+                add_covariates=add_covariates,
+                add_random_effects=add_random_effects,
+            )
+
+            lmm_drug = lmm_drug.rename(columns={"GeneSymbol": "x_feature"})
+            lmm_drug = lmm_drug[lmm_drug.set_index(self.dcols).index.isin(drugs)]
+            lmm_drug = lmm_drug[lmm_drug_cols]
+
+            drugs_tested = set(lmm_drug.set_index(self.dcols).index)
+            drugs_fit = [d for d in drugs if d not in drugs_tested]
+
+        else:
+            drugs_fit = drugs
+
         # - yy
-        y_drug = self.drespo.loc[drugs, samples].T
-        y_crispr = self.crispr.loc[genes, samples].T
+        y_drug = self.drespo.loc[drugs_fit, samples].T
+        y_crispr = self.crispr.loc[list(genes), samples].T
 
         # - x
         if x_dtype == "gexp":
@@ -387,74 +1564,73 @@ class Association:
         m = self.get_covariates().loc[samples] if add_covariates else None
 
         logging.getLogger("DTrace").info(
-            f"Assoc={pairs.shape[0]}; Genes={len(genes)}; Drugs={len(drugs)}; Samples={len(samples)}"
+            f"Assoc={pairs.shape[0]}; Genes={len(genes)}; Drugs={len(drugs)}; Samples={len(samples)}; "
+            f"Drugs reused={len(drugs) - len(drugs_fit)}"
         )
 
         # - Drug associations ((DRUG_ID, DRUG_NAME, VERSION), x_feature)
-        lmm_drug = pd.concat(
-            [
-                self.lmm_single_association(
-                    y_drug[[d]],
-                    x,
-                    k=k,
-                    m=m,
-                    transform_x="scale" if x_dtype == "gexp" else "min_events",
-                    verbose=verbose,
-                )
-                for d in y_drug
+        lmm_drug_fit = []
+
+        if len(drugs_fit) > 0:
+            lmm_drug_fit = self.lmm_single_association_batch(
+                y_drug,
+                x,
+                k=k,
+                m=m,
+                transform_x="scale" if x_dtype == "gexp" else "min_events",
+                engine=engine,
+                n_jobs=n_jobs,
+                chunk_size=chunk_size,
+                verbose=verbose,
+            )
+            lmm_drug_fit = [
+                d.rename(columns={"GeneSymbol": "x_feature"})[lmm_drug_cols]
+                for d in lmm_drug_fit
             ]
-        ).rename(columns={"GeneSymbol": "x_feature"})
+
+        lmm_drug = pd.concat(([] if lmm_drug is None else [lmm_drug]) + lmm_drug_fit)
         lmm_drug = lmm_drug.set_index(self.drespo_obj.DRUG_COLUMNS)
 
+        # - CRISPR associations cache
+        crispr_checkpoint, crispr_fingerprints = None, None
+
+        if crispr_cache_dir is not None:
+            params = dict(
+                x_dtype=x_dtype,
+                engine=engine,
+                add_covariates=add_covariates,
+                add_random_effects=add_random_effects,
+            )
+
+            crispr_checkpoint = AssociationCheckpoint(crispr_cache_dir, params=params)
+
+            fp_inputs = DataImporter.DataFingerprint.hash(x, k, m, params)
+            crispr_fingerprints = {
+                g: DataImporter.DataFingerprint.hash(y_crispr[g], fp_inputs)
+                for g in y_crispr
+            }
+
         # - CRISPR associations (Y_ID, x_feature)
         lmm_crispr = pd.concat(
-            [
-                self.lmm_single_association(
-                    y_crispr[[g]],
-                    x,
-                    k=k,
-                    m=m,
-                    transform_x="scale" if x_dtype == "gexp" else "min_events",
-                    expand_id=False,
-                    verbose=verbose,
-                )
-                for g in y_crispr
-            ]
+            self.lmm_single_association_batch(
+                y_crispr,
+                x,
+                k=k,
+                m=m,
+                transform_x="scale" if x_dtype == "gexp" else "min_events",
+                expand_id=False,
+                engine=engine,
+                n_jobs=n_jobs,
+                chunk_size=chunk_size,
+                checkpoint=crispr_checkpoint,
+                fingerprints=crispr_fingerprints,
+                verbose=verbose,
+            )
         ).rename(columns={"GeneSymbol": "x_feature"})
         lmm_crispr = lmm_crispr.set_index("Y_ID")
 
         # - Expand <Drug, CRISPR> associations
-        lmm_robust = []
-        for i in pairs.index:
-            row = pairs.loc[i]
-
-            drug = tuple(row[self.drespo_obj.DRUG_COLUMNS].values)
-            gene = row["GeneSymbol"]
-
-            pair_associations = (
-                pd.concat(
-                    [
-                        lmm_drug.loc[drug].set_index("x_feature").add_prefix("drug_"),
-                        lmm_crispr.loc[gene]
-                        .set_index("x_feature")
-                        .add_prefix("crispr_"),
-                    ],
-                    axis=1,
-                    sort=False,
-                )
-                .dropna()
-                .reset_index()
-                .rename(columns={"index": x_dtype})
-            )
-
-            pair_associations.insert(0, "GeneSymbol", gene)
-            pair_associations.insert(0, "VERSION", drug[2])
-            pair_associations.insert(0, "DRUG_NAME", drug[1])
-            pair_associations.insert(0, "DRUG_ID", drug[0])
-
-            lmm_robust.append(pair_associations)
-
-        lmm_robust = pd.concat(lmm_robust).reset_index(drop=True)
+        lmm_robust = self.lmm_robust_expand(pairs, lmm_drug, lmm_crispr)
 
         lmm_robust = self.multipletests_per_drug(
             lmm_robust,
@@ -480,6 +1656,179 @@ class Association:
 
         return lmm_robust
 
+    @classmethod
+    def check_lmm_params(
+        cls, associations, x_dtype, engine, add_covariates, add_random_effects
+    ):
+        """
+        Check that associations (e.g. of lmm_single_associations) were fitted with the same model settings.
+
+        """
+        params = associations.attrs.get(cls.LMM_PARAMS_ATTR)
+
+        if params is None:
+            logging.getLogger("DTrace").warning(
+                "Model settings of the reused associations are not recorded and can't be checked"
+            )
+            return
+
+        expected = dict(
+            x_dtype=x_dtype,
+            engine=engine,
+            add_covariates=add_covariates,
+            add_random_effects=add_random_effects,
+        )
+
+        # Without random effects both engines fit the same fixed effects model
+        if not add_random_effects:
+            params, expected = dict(params, engine=None), dict(expected, engine=None)
+
+        if params != expected:
+            raise ValueError(
+                f"Associations were fitted with {params}, not with {expected}"
+            )
+
+    @staticmethod
+    def lmm_robust_expand(pairs, lmm_drug, lmm_crispr):
+        """
+        Join the drug and the CRISPR gene associations with the same feature for every significant <Drug, CRISPR>
+        pair, as a single relational join keyed on x_feature.
+
+        :param pairs: Significant pairs, with DRUG_COLUMNS and GeneSymbol.
+        :param lmm_drug: Drug associations indexed by DRUG_COLUMNS, with x_feature.
+        :param lmm_crispr: CRISPR gene associations indexed by Y_ID, with x_feature.
+        :return: pandas DataFrame
+        """
+        dcols = DataImporter.DrugResponse.DRUG_COLUMNS
+
+        drug_stats = [c for c in lmm_drug if c != "x_feature"]
+        crispr_stats = [c for c in lmm_crispr if c != "x_feature"]
+
+        lmm_drug = lmm_drug.reset_index().rename(
+            columns={c: f"drug_{c}" for c in drug_stats}
+        )
+
+        lmm_crispr = lmm_crispr.reset_index().rename(
+            columns={"Y_ID": "GeneSymbol", **{c: f"crispr_{c}" for c in crispr_stats}}
+        )
+
+        lmm_robust = (
+            pairs[dcols + ["GeneSymbol"]]
+            .merge(lmm_drug, on=dcols)
+            .merge(lmm_crispr, on=["GeneSymbol", "x_feature"])
+        )
+
+        stats_cols = [f"drug_{c}" for c in drug_stats] + [
+            f"crispr_{c}" for c in crispr_stats
+        ]
+
+        return lmm_robust.dropna(subset=stats_cols).reset_index(drop=True)
+
+    def lmm_interaction_associations(
+        self,
+        lmm_dsingle,
+        add_covariates=True,
+        add_random_effects=True,
+        fdr_thres=0.1,
+        min_events=5,
+        block_size=256,
+        kinship_cache_size=8,
+        verbose=0,
+    ):
+        """
+        Test if the association between a drug and a CRISPR gene is modified by genomic events (Genomic.mobem), i.e.
+        drug ~ gene + feature + gene:feature with the same covariates and kinship as the Drug ~ CRISPR single
+        feature associations. Only significant <Drug, CRISPR> pairs are tested, against all genomic features in
+        blocks of block_size with the native engine (dtrace.LMMEngine.LMMEngine.interaction_scan), where the
+        variance components of each drug are estimated once under the null model.
+
+        :param lmm_dsingle: Drug ~ CRISPR associations (lmm_single_associations).
+        :param fdr_thres: FDR threshold defining the significant pairs.
+        :param min_events: Minimum number of events of a genomic feature among the samples of a drug.
+        :param block_size: Number of genomic features tested at once.
+        :return: pandas DataFrame with the interaction beta, beta_se, pval and fdr (per <Drug, CRISPR> pair) of each
+            genomic feature (x_feature)
+        """
+        # - Get significant <Drug, CRISPR> pairs
+        pairs = lmm_dsingle.query(f"fdr < {fdr_thres}")[self.dcols + ["GeneSymbol"]]
+        pairs = pairs.drop_duplicates()
+
+        # - Samples with CRISPR and genomic measurements
+        samples = [s for s in self.samples if s in set(self.genomic)]
+
+        # - x and genomic features
+        x = self.crispr[samples].T
+        features = self.genomic[samples].T
+
+        # - Kinship matrix (random effects)
+        k = self.kinship(x).loc[samples, samples] if add_random_effects else None
+        kinship_cache = (
+            None if k is None else KinshipCache(k, maxsize=kinship_cache_size)
+        )
+
+        # - Covariates
+        m = self.get_covariates().loc[samples] if add_covariates else None
+
+        # - Interaction scans
+        res = []
+
+        for drug, d_pairs in pairs.groupby(self.dcols, sort=False):
+            params = Association.lmm_association_data(
+                y=self.drespo.loc[[drug], samples].T,
+                x=x[d_pairs["GeneSymbol"]],
+                m=m,
+                k=k,
+                transform_x="scale",
+            )
+
+            lmm = Association.lmm_null_model(params, kinship_cache=kinship_cache)
+
+            d_features = features.loc[params["y"].index]
+            d_features = d_features.loc[
+                :, (d_features.std() > 0) & (d_features.sum() >= min_events)
+            ]
+
+            for gene in params["x"]:
+                for i in range(0, d_features.shape[1], block_size):
+                    f_block = d_features.iloc[:, i : i + block_size]
+
+                    beta, beta_se, pval = lmm.interaction_scan(
+                        params["x"][gene].values, f_block.values
+                    )
+
+                    res.append(
+                        pd.DataFrame(
+                            dict(
+                                **dict(zip(self.dcols, drug)),
+                                GeneSymbol=gene,
+                                x_feature=f_block.columns,
+                                beta=beta,
+                                beta_se=beta_se,
+                                pval=pval,
+                                samples=params["y"].shape[0],
+                            )
+                        )
+                    )
+
+            if verbose > 0:
+                logging.getLogger("DTrace").info(
+                    f"[lmm_interaction_associations] Drug {drug[1]}: {params['x'].shape[1]} genes x "
+                    f"{d_features.shape[1]} features"
+                )
+
+        lmm_interaction = pd.concat(res, ignore_index=True)
+
+        # - Multiple p-value correction (per <Drug, CRISPR> pair)
+        lmm_interaction = self.multipletests_per_drug(
+            lmm_interaction,
+            index_cols=self.dcols + ["GeneSymbol"],
+            method=self.pval_method,
+        )
+
+        lmm_interaction = self.annotate_drug_target(lmm_interaction)
+
+        return lmm_interaction.sort_values(["fdr", "pval"])
+
     def annotate_drug_target(self, associations):
         d_targets = self.drespo_obj.get_drugtargets()
 
@@ -533,56 +1882,42 @@ class Association:
         :param feature: For Robust Associations ONLY
         :return:
         """
+        conditions = dict(
+            drug_id=drug_id,
+            drug_name=drug_name,
+            drug_version=drug_version,
+            gene_name=gene_name,
+            target=target,
+            x_feature=x_feature,
+            fdr=fdr,
+            fdr_reverse=fdr_reverse,
+            pval=pval,
+            pval_reverse=pval_reverse,
+        )
 
-        df = associations.copy()
-
-        if fdr is not None:
-            if fdr_reverse:
-                df = df[df["fdr"] >= fdr]
-            else:
-                df = df[df["fdr"] < fdr]
-
-        if pval is not None:
-            if pval_reverse:
-                df = df[df["pval"] >= pval]
-            else:
-                df = df[df["pval"] < pval]
-
-        if drug_id is not None:
-            if (type(drug_id) == list) or (type(drug_id) == set):
-                df = df[df["DRUG_ID"].isin(drug_id)]
-            else:
-                df = df[df["DRUG_ID"] == drug_id]
+        index = AssociationIndex.of(associations)
 
-        if drug_name is not None:
-            if (type(drug_name) == list) or (type(drug_name) == set):
-                df = df[df["DRUG_NAME"].isin(drug_name)]
-            else:
-                df = df[df["DRUG_NAME"] == drug_name]
+        if index is not None:
+            pos = index.select(**conditions)
+            return associations.copy() if pos is None else associations.iloc[pos]
 
-        if drug_version is not None:
-            if (type(drug_version) == list) or (type(drug_version) == set):
-                df = df[df["VERSION"].isin(drug_version)]
-            else:
-                df = df[df["VERSION"] == drug_version]
+        mask = np.ones(associations.shape[0], dtype=bool)
 
-        if gene_name is not None:
-            if (type(gene_name) == list) or (type(gene_name) == set):
-                df = df[df["GeneSymbol"].isin(gene_name)]
-            else:
-                df = df[df["GeneSymbol"] == gene_name]
+        for k, c in AssociationIndex.RANGE_COLS.items():
+            if conditions[k] is not None:
+                if conditions[f"{k}_reverse"]:
+                    mask &= (associations[c] >= conditions[k]).values
+                else:
+                    mask &= (associations[c] < conditions[k]).values
 
-        if target is not None:
-            if (type(target) == list) or (type(target) == set):
-                df = df[df["target"].isin(target)]
-            else:
-                df = df[df["target"] == target]
+        for k, c in AssociationIndex.KEY_COLS.items():
+            if conditions[k] is not None:
+                if (type(conditions[k]) == list) or (type(conditions[k]) == set):
+                    mask &= associations[c].isin(conditions[k]).values
+                else:
+                    mask &= (associations[c] == conditions[k]).values
 
-        if x_feature is not None:
-            if (type(x_feature) == list) or (type(x_feature) == set):
-                df = df[df["x_feature"].isin(x_feature)]
-            else:
-                df = df[df["x_feature"] == x_feature]
+        df = associations[mask]
 
         return df
 
@@ -666,34 +2001,144 @@ class Association:
 
         return discrete
 
+    # Methods of statsmodels multipletests computed with grouped numpy operations in multipletests_grouped
+    MULTIPLETESTS_VECTORISED = {"bonferroni", "sidak", "holm", "fdr_bh", "fdr_by"}
+
+    @staticmethod
+    def multipletests_grouped(pvals, groups, method):
+        """
+        Multiple testing correction applied independently within each group, equivalent to calling
+        statsmodels multipletests on every group but computed in one pass over numpy arrays: p-values are sorted by
+        (group, p-value) and the ranks, group sizes and step-up/step-down cumulative minima/maxima are obtained
+        with grouped operations, without splitting the data into one frame per group. Methods not in
+        Association.MULTIPLETESTS_VECTORISED fall back to multipletests on each group. Missing p-values are excluded
+        from the number of tests and returned as NaN.
+
+        :param pvals: Array of p-values.
+        :param groups: Array of integer group codes (e.g. pandas.factorize of the drug ids).
+        :param method: Any option available in multipletests.
+        :return: Array of adjusted p-values, same order as pvals
+        """
+        pvals = np.asarray(pvals, dtype=np.float64)
+        groups = np.asarray(groups, dtype=np.int64)
+
+        adjusted = np.full(pvals.shape[0], np.nan)
+
+        tested = np.flatnonzero(~np.isnan(pvals))
+
+        if tested.shape[0] == 0:
+            return adjusted
+
+        order = tested[np.lexsort((pvals[tested], groups[tested]))]
+
+        p, g = pvals[order], np.unique(groups[order], return_inverse=True)[1]
+
+        # Size of each group and rank of each p-value within its group
+        counts = np.bincount(g)
+        starts = np.cumsum(counts) - counts
+
+        ntests = counts[g].astype(np.float64)
+        rank = np.arange(p.shape[0]) - starts[g] + 1
+
+        if method not in Association.MULTIPLETESTS_VECTORISED:
+            p_adj = np.concatenate(
+                [
+                    multipletests(p[s : s + c], method=method)[1]
+                    for s, c in zip(starts, counts)
+                ]
+            )
+
+        elif method == "bonferroni":
+            p_adj = np.clip(p * ntests, 0, 1)
+
+        elif method == "sidak":
+            with np.errstate(divide="ignore"):
+                p_adj = -np.expm1(ntests * np.log1p(-p))
+
+        elif method == "holm":
+            p_adj = np.clip(p * (ntests - rank + 1), 0, 1)
+            p_adj = pd.Series(p_adj).groupby(g).cummax().values
+
+        else:
+            p_adj = p * ntests / rank
+
+            if method == "fdr_by":
+                harmonic = np.cumsum(1.0 / np.arange(1, counts.max() + 1))
+                p_adj *= harmonic[counts[g] - 1]
+
+            p_adj = np.clip(p_adj, 0, 1)
+            p_adj = pd.Series(p_adj[::-1]).groupby(g[::-1]).cummin().values[::-1]
+
+        adjusted[order] = p_adj
+
+        return adjusted
+
     @staticmethod
     def multipletests_per_drug(
         associations, method, field="pval", fdr_field="fdr", index_cols=None
     ):
+        """
+        Multiple testing correction of the associations of each drug (or any other group defined by index_cols).
+
+        :param associations: Associations data-frame.
+        :param method: Any option available in statsmodels multipletests.
+        :param field: Column with the p-values.
+        :param fdr_field: Column where the adjusted p-values are stored.
+        :param index_cols: Columns defining the groups, defaults to DataImporter.DrugResponse.DRUG_COLUMNS.
+        :return: data-frame with the index_cols first and fdr_field last
+        """
         index_cols = (
             DataImporter.DrugResponse.DRUG_COLUMNS if index_cols is None else index_cols
         )
 
-        d_unique = {tuple(i) for i in associations[index_cols].values}
+        groups = associations.groupby(index_cols, sort=False, dropna=False).ngroup()
+
+        other_cols = [
+            c for c in associations if (c not in index_cols) and (c != fdr_field)
+        ]
 
-        df = associations.set_index(index_cols)
+        df = associations[list(index_cols) + other_cols].reset_index(drop=True)
 
-        df = pd.concat(
-            [
-                df.loc[i]
-                .assign(fdr=multipletests(df.loc[i, field], method=method)[1])
-                .rename(columns={"fdr": fdr_field})
-                for i in d_unique
-            ]
-        ).reset_index()
+        df[fdr_field] = Association.multipletests_grouped(
+            associations[field].values, groups.values, method
+        )
 
         return df
 
+    @staticmethod
+    def multipletests_per_drug_stream(
+        partitions, method, field="pval", fdr_field="fdr", index_cols=None
+    ):
+        """
+        Apply multipletests_per_drug to partitioned associations (e.g. one file per drug or the shards of an
+        AssociationCheckpoint run directory) without loading them all in memory. Groups must not be split across
+        partitions.
+
+        :param partitions: Iterable of data-frames or of paths to pickle (.pkl) or CSV files.
+        :return: generator of corrected data-frames, one per partition
+        """
+        for partition in partitions:
+            if isinstance(partition, str):
+                partition = (
+                    pd.read_pickle(partition)
+                    if partition.endswith(".pkl")
+                    else pd.read_csv(partition)
+                )
+
+            yield Association.multipletests_per_drug(
+                partition,
+                method=method,
+                field=field,
+                fdr_field=fdr_field,
+                index_cols=index_cols,
+            )
+
     @staticmethod
     def get_association(lmm_associations, drug, gene):
-        return lmm_associations[
-            (lmm_associations[DataImporter.DrugResponse.DRUG_COLUMNS[0]] == drug[0])
-            & (lmm_associations[DataImporter.DrugResponse.DRUG_COLUMNS[1]] == drug[1])
-            & (lmm_associations[DataImporter.DrugResponse.DRUG_COLUMNS[2]] == drug[2])
-            & (lmm_associations["GeneSymbol"] == gene)
-        ]
+        return Association.by(
+            lmm_associations,
+            drug_id=drug[0],
+            drug_name=drug[1],
+            drug_version=drug[2],
+            gene_name=gene,
+        )
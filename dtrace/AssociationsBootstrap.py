@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# Copyright (C) 2019 Emanuel Goncalves
+
+import logging
+import numpy as np
+from dtrace.Associations import Association
+from dtrace.DataImporter import DrugResponse
+from dtrace.LMMEngine import KinshipCache
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+
+# - Process pool workers: data shared by all the replicates of a worker is set once by the initializer
+_BOOTSTRAP_WORKER = {}
+
+
+def _bootstrap_worker_init(y, x, m, k, pairs, transform_x, kinship_cache_size):
+    _BOOTSTRAP_WORKER.update(
+        y=y,
+        x=x,
+        m=m,
+        k=k,
+        pairs=pairs,
+        transform_x=transform_x,
+        kinship_cache=(
+            None if k is None else KinshipCache(k, maxsize=kinship_cache_size)
+        ),
+    )
+
+
+def _bootstrap_worker_block(replicates, kwargs):
+    return AssociationBootstrap.refit_block(
+        replicates,
+        _BOOTSTRAP_WORKER["y"],
+        _BOOTSTRAP_WORKER["x"],
+        _BOOTSTRAP_WORKER["pairs"],
+        m=_BOOTSTRAP_WORKER["m"],
+        k=_BOOTSTRAP_WORKER["k"],
+        transform_x=_BOOTSTRAP_WORKER["transform_x"],
+        kinship_cache=_BOOTSTRAP_WORKER["kinship_cache"],
+        **kwargs,
+    )
+
+
+class AssociationBootstrap:
+    """
+    Stability of significant drug-feature associations to the resampling of cell lines. The significant pairs of a
+    scan (e.g. Association.lmm_single_associations) are refitted with the native LMM engine on bootstrap samples
+    (drawn with replacement) or subsamples (drawn without replacement) of the cell lines, keeping the kinship and
+    covariates of the original scan. Each drug is refitted only against its significant features.
+
+    Bootstrap samples repeat cell lines, which duplicates rows and columns of the kinship and makes the variance
+    components of the LMM degenerate, hence scans with random effects are resampled by subsampling.
+
+    Replicates are refitted in blocks across a process pool. Block sizes and the number of blocks in flight are
+    derived from a memory budget, and only the effect sizes of the significant pairs are kept per replicate.
+
+    """
+
+    METHODS = ["bootstrap", "subsample"]
+
+    def __init__(self, y, x, m=None, k=None, transform_x="scale"):
+        """
+        :param y: Drug response (samples x drugs), columns labelled as DrugResponse.DRUG_COLUMNS tuples.
+        :param x: Features (samples x features).
+        :param m: Optional covariates (samples x covariates).
+        :param k: Optional kinship (samples x samples data-frame or KinshipFactor) of the original scan.
+        :param transform_x: Transformation of x, as in Association.lmm_association_data.
+
+        """
+        self.y = y
+        self.x = x
+        self.m = m
+        self.k = k
+        self.transform_x = transform_x
+
+    @classmethod
+    def from_association(
+        cls,
+        assoc,
+        x_dtype="crispr",
+        add_covariates=True,
+        add_random_effects=True,
+        low_rank_kinship=False,
+        kinship_rank=None,
+    ):
+        """
+        Bootstrap of the data of Association.lmm_single_associations with the same arguments.
+
+        :param assoc: dtrace.Associations.Association
+        """
+        y, x, k, m = assoc.lmm_single_data(
+            x_dtype=x_dtype,
+            add_covariates=add_covariates,
+            add_random_effects=add_random_effects,
+            low_rank_kinship=low_rank_kinship,
+            kinship_rank=kinship_rank,
+        )
+
+        return cls(
+            y,
+            x,
+            m=m,
+            k=k,
+            transform_x="scale" if x_dtype != "genomic" else "min_events",
+        )
+
+    @staticmethod
+    def significant_pairs(associations, fdr_thres=0.1):
+        """
+        Significant pairs and, per drug, the p-value threshold used to call a pair selected in a replicate: the
+        Benjamini-Hochberg cutoff of the drug in the original scan, fdr_thres x (number of significant pairs) /
+        (number of tests).
+
+        :return: pandas DataFrame of the pairs (drug columns, GeneSymbol, beta, pval, fdr and pval_thres)
+        """
+        dcols = DrugResponse.DRUG_COLUMNS
+
+        n_tests = associations.groupby(dcols).size().rename("n_tests")
+
+        pairs = associations.query(f"fdr < {fdr_thres}")
+        pairs = pairs[dcols + ["GeneSymbol", "beta", "pval", "fdr"]]
+
+        pairs = pairs.join(n_tests, on=dcols)
+        pairs = pairs.assign(
+            pval_thres=fdr_thres
+            * pairs.groupby(dcols)["pval"].transform("size")
+            / pairs["n_tests"]
+        ).drop(columns=["n_tests"])
+
+        return pairs.sort_values(dcols + ["GeneSymbol"]).reset_index(drop=True)
+
+    @staticmethod
+    def resample(samples, replicate, method="bootstrap", fraction=0.8, seed=0):
+        """
+        Cell lines of a replicate, drawn from an independent stream per (seed, replicate) so that results do not
+        depend on how replicates are split across blocks and processes.
+
+        :return: numpy array of positions in samples
+        """
+        rng = np.random.default_rng([seed, replicate])
+        n = len(samples)
+
+        if method == "bootstrap":
+            return np.sort(rng.integers(0, n, n))
+
+        return np.sort(rng.choice(n, int(round(fraction * n)), replace=False))
+
+    @staticmethod
+    def refit_block(
+        replicates,
+        y,
+        x,
+        pairs,
+        m=None,
+        k=None,
+        transform_x="scale",
+        kinship_cache=None,
+        method="bootstrap",
+        fraction=0.8,
+        seed=0,
+    ):
+        """
+        Refit the pairs on the cell lines of each replicate. The same cell lines are drawn for all drugs of a
+        replicate, so drugs sharing the same pattern of missing measurements reuse the kinship decomposition.
+
+        :param pairs: List of (drug, features) tuples, features of each drug in the order of the output columns.
+        :return: Tuple of numpy arrays (replicates x pairs), effect sizes and p-values (NaN if not tested, e.g.
+            features constant in a replicate)
+        """
+        n_pairs = sum(len(features) for _, features in pairs)
+
+        betas = np.full((len(replicates), n_pairs), np.nan)
+        pvals = np.full((len(replicates), n_pairs), np.nan)
+
+        for i, b in enumerate(replicates):
+            y_b = y.iloc[
+                AssociationBootstrap.resample(
+                    y.index, b, method=method, fraction=fraction, seed=seed
+                )
+            ]
+
+            j = 0
+            for drug, features in pairs:
+                res, _ = Association.lmm_association_native(
+                    y=y_b[[drug]],
+                    x=x[features],
+                    m=m,
+                    k=k,
+                    transform_x=transform_x,
+                    kinship_cache=kinship_cache,
+                )
+
+                res = res.set_index("effect_name").reindex(features)
+
+                betas[i, j : j + len(features)] = res["effsize"].values
+                pvals[i, j : j + len(features)] = res["pv20"].values
+
+                j += len(features)
+
+        return betas, pvals
+
+    def block_size(self, n_pairs, n_replicates, n_jobs, memory_budget, max_features):
+        """
+        Number of replicates per block within memory_budget (bytes), accounting for the effect sizes kept for every
+        replicate, the refits running in each worker (kinship submatrix, its decomposition and the whitened
+        features) and the results of the blocks in flight (at most 2 per worker).
+
+        """
+        n = self.y.shape[0]
+
+        betas_bytes = 8 * n_pairs * n_replicates
+        fit_bytes = 8 * n * (3 * n + 2 * max_features)
+        replicate_bytes = 8 * 2 * n_pairs
+
+        free = memory_budget - betas_bytes - n_jobs * fit_bytes
+
+        if free < 2 * n_jobs * replicate_bytes:
+            raise ValueError(
+                f"memory_budget={memory_budget} bytes is too small, "
+                f"at least {betas_bytes + n_jobs * (fit_bytes + 2 * replicate_bytes)} bytes are needed"
+            )
+
+        max_block = int(np.ceil(n_replicates / n_jobs))
+
+        return int(min(max_block, free // (2 * n_jobs * replicate_bytes)))
+
+    def run(
+        self,
+        associations,
+        fdr_thres=0.1,
+        n_replicates=100,
+        method=None,
+        fraction=0.8,
+        alpha=0.05,
+        n_jobs=1,
+        memory_budget=2 * 1024**3,
+        kinship_cache_size=8,
+        seed=0,
+        verbose=0,
+    ):
+        """
+        :param associations: Associations of the original scan, with fdr (e.g. Association.lmm_single_associations).
+        :param fdr_thres: FDR threshold defining the significant pairs.
+        :param n_replicates: Number of resampled replicates.
+        :param method: "bootstrap" (n cell lines drawn with replacement) or "subsample" (fraction of the cell lines
+            drawn without replacement). Defaults to "subsample" with a kinship and "bootstrap" otherwise, "bootstrap"
+            is not supported with a kinship.
+        :param fraction: Fraction of cell lines of each subsample.
+        :param alpha: Confidence level of the percentile intervals of beta is 1 - alpha.
+        :param n_jobs: Number of worker processes. Results are identical to the serial run (n_jobs=1).
+        :param memory_budget: Maximum memory (bytes) used by the refits and their results.
+        :param seed: Seed of the resampling.
+        :return: pandas DataFrame of the significant pairs with the number of replicates where the pair was tested
+            (n_replicates), the fraction of those where it was selected (selection_freq, p-value below the
+            Benjamini-Hochberg cutoff of the drug in the original scan) and where beta had the original sign
+            (sign_freq), and the mean (beta_boot), standard deviation (beta_boot_se) and percentile interval
+            (beta_ci_low, beta_ci_high) of beta across replicates
+        """
+        if method is None:
+            method = "bootstrap" if self.k is None else "subsample"
+
+        if method not in self.METHODS:
+            raise ValueError(f"method must be one of {self.METHODS}")
+
+        if (method == "bootstrap") and (self.k is not None):
+            raise ValueError(
+                "Bootstrap samples duplicate rows of the kinship, use method='subsample' with random effects"
+            )
+
+        dcols = DrugResponse.DRUG_COLUMNS
+
+        pairs = self.significant_pairs(associations, fdr_thres=fdr_thres)
+
+        drug_pairs = [
+            (drug, list(df["GeneSymbol"]))
+            for drug, df in pairs.groupby(dcols, sort=False)
+        ]
+
+        if len(drug_pairs) == 0:
+            raise ValueError(f"No associations with fdr < {fdr_thres}")
+
+        # Only the drugs and features refitted are sent to the workers
+        y = self.y[[drug for drug, _ in drug_pairs]]
+        x = self.x[pairs["GeneSymbol"].unique()]
+
+        block = self.block_size(
+            pairs.shape[0],
+            n_replicates,
+            n_jobs,
+            memory_budget,
+            max(len(features) for _, features in drug_pairs),
+        )
+
+        blocks = [
+            list(range(i, min(i + block, n_replicates)))
+            for i in range(0, n_replicates, block)
+        ]
+
+        block_kws = dict(method=method, fraction=fraction, seed=seed)
+
+        betas = np.full((n_replicates, pairs.shape[0]), np.nan)
+        selected = np.zeros(pairs.shape[0])
+
+        def collect(replicates, block_res):
+            b_betas, b_pvals = block_res
+
+            betas[replicates] = b_betas
+
+            selected[:] += (b_pvals <= pairs["pval_thres"].values).sum(0)
+
+            if verbose:
+                logging.getLogger("DTrace").info(
+                    f"[AssociationBootstrap] {replicates[-1] + 1}/{n_replicates} replicates done"
+                )
+
+        if n_jobs == 1:
+            _bootstrap_worker_init(
+                y, x, self.m, self.k, drug_pairs, self.transform_x, kinship_cache_size
+            )
+
+            try:
+                for replicates in blocks:
+                    collect(replicates, _bootstrap_worker_block(replicates, block_kws))
+
+            finally:
+                _BOOTSTRAP_WORKER.clear()
+
+        else:
+            with ProcessPoolExecutor(
+                max_workers=n_jobs,
+                initializer=_bootstrap_worker_init,
+                initargs=(
+                    y,
+                    x,
+                    self.m,
+                    self.k,
+                    drug_pairs,
+                    self.transform_x,
+                    kinship_cache_size,
+                ),
+            ) as executor:
+                # Blocks are submitted as others complete, bounding the results held in memory
+                pending, futures = list(reversed(blocks)), {}
+
+                while pending or futures:
+                    while pending and (len(futures) < 2 * n_jobs):
+                        replicates = pending.pop()
+                        futures[
+                            executor.submit(
+                                _bootstrap_worker_block, replicates, block_kws
+                            )
+                        ] = replicates
+
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        collect(futures.pop(future), future.result())
+
+        # - Stability summary
+        tested = np.isfinite(betas).sum(0)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            pairs = pairs.assign(
+                n_replicates=tested,
+                selection_freq=selected / tested,
+                sign_freq=(np.sign(betas) == np.sign(pairs["beta"].values)).sum(0)
+                / tested,
+                beta_boot=np.nanmean(betas, 0),
+                beta_boot_se=np.nanstd(betas, 0, ddof=1),
+                beta_ci_low=np.nanquantile(betas, alpha / 2, 0),
+                beta_ci_high=np.nanquantile(betas, 1 - alpha / 2, 0),
+            )
+
+        return pairs.drop(columns=["pval_thres"])
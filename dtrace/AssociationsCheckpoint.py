@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# Copyright (C) 2019 Emanuel Goncalves
+
+import os
+import re
+import json
+import hashlib
+import logging
+import pandas as pd
+
+
+class AssociationCheckpoint:
+    """
+    Persists the associations of each trait (e.g. drug) to a run directory as soon as they are tested, so that an
+    interrupted run can be resumed skipping the traits already finished.
+
+    Each shard can be stored together with the fingerprint of its inputs (see DataImporter.DataFingerprint), in which
+    case it is only reused while the fingerprint is unchanged, e.g. drugs whose measurements did not change between
+    releases.
+
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, run_dir, params=None):
+        """
+        :param run_dir: Directory where the result shards are stored. Created if it does not exist.
+
+        :param params: Dictionary of the run parameters (e.g. x_dtype, engine). Resuming a run directory created with
+            different parameters raises a ValueError.
+
+        """
+        self.run_dir = run_dir
+        self.params = json.loads(
+            json.dumps({} if params is None else params, default=str)
+        )
+
+        os.makedirs(self.run_dir, exist_ok=True)
+
+        manifest_file = os.path.join(self.run_dir, self.MANIFEST)
+
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as f:
+                manifest = json.load(f)
+
+            if manifest != self.params:
+                raise ValueError(
+                    f"Run directory {self.run_dir} was created with different parameters: {manifest}"
+                )
+
+        else:
+            with open(manifest_file, "w") as f:
+                json.dump(self.params, f, indent=2, sort_keys=True)
+
+    def shard_file(self, key):
+        label = "_".join(map(str, key)) if type(key) == tuple else str(key)
+        digest = hashlib.md5(label.encode()).hexdigest()[:8]
+        label = re.sub(r"[^\w.-]+", "_", label)[:64]
+
+        return os.path.join(self.run_dir, f"{label}_{digest}.pkl")
+
+    def get_fingerprint(self, key):
+        fingerprint_file = f"{self.shard_file(key)}.sha1"
+
+        if not os.path.exists(fingerprint_file):
+            return None
+
+        with open(fingerprint_file) as f:
+            return f.read().strip()
+
+    def is_done(self, key, fingerprint=None):
+        if not os.path.exists(self.shard_file(key)):
+            return False
+
+        return (fingerprint is None) or (self.get_fingerprint(key) == fingerprint)
+
+    def load(self, key):
+        return pd.read_pickle(self.shard_file(key))
+
+    def save(self, key, associations, fingerprint=None):
+        shard_file = self.shard_file(key)
+
+        # Write to a temporary file first so that a crash never leaves a partial shard behind
+        associations.to_pickle(f"{shard_file}.tmp")
+        os.replace(f"{shard_file}.tmp", shard_file)
+
+        # Fingerprint is written last, a shard without it is never reused when fingerprints are checked
+        if fingerprint is not None:
+            with open(f"{shard_file}.sha1", "w") as f:
+                f.write(fingerprint)
+
+    def resume(self, keys, fingerprints=None):
+        """
+        Load the associations of the traits already tested.
+
+        :param keys: Trait identifiers.
+        :param fingerprints: Optional dict of trait -> fingerprint of its inputs. Shards with a different (or
+            missing) fingerprint are discarded and the trait is tested again.
+        :return: dict of trait -> associations data-frame
+        """
+        fingerprints = {} if fingerprints is None else fingerprints
+
+        done = {k: self.load(k) for k in keys if self.is_done(k, fingerprints.get(k))}
+
+        logging.getLogger("DTrace").info(
+            f"[AssociationCheckpoint] {self.run_dir}: {len(done)}/{len(keys)} up to date"
+        )
+
+        return done
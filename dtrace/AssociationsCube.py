@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# Copyright (C) 2019 Emanuel Goncalves
+
+import os
+import pickle
+import weakref
+import numpy as np
+import pandas as pd
+from dtrace.DataImporter import DrugResponse
+
+
+class AssociationCube:
+    """
+    Dense representation of the associations of a scan: a statistics x drugs x features array (e.g. beta, pval and
+    fdr of every drug and gene) with label indexes, built once from the long-format table. Matrices of one statistic,
+    and vectors of one drug or one feature, are returned as views of the array without copying. The array can be
+    backed by a memory-mapped file (see AssociationCube.save and AssociationCube.load).
+
+    """
+
+    STATISTICS = ["beta", "beta_se", "pval", "fdr"]
+
+    VALUES_FILE = "values.npy"
+    LABELS_FILE = "labels.pkl"
+
+    _cache = {}
+
+    def __init__(self, values, drugs, features, statistics):
+        """
+        :param values: numpy array (statistics x drugs x features).
+        :param drugs: pandas Index or MultiIndex of the drugs.
+        :param features: pandas Index of the features.
+        :param statistics: List of statistic names.
+
+        """
+        self.values = values
+        self.drugs = drugs
+        self.features = features
+        self.statistics = list(statistics)
+
+    @classmethod
+    def from_associations(
+        cls,
+        associations,
+        statistics=None,
+        drug_cols=None,
+        feature_col="GeneSymbol",
+        dtype=np.float64,
+        memmap_file=None,
+    ):
+        """
+        :param associations: Long-format associations (e.g. Association.lmm_single_associations).
+        :param statistics: Columns stored, defaults to the columns of AssociationCube.STATISTICS present.
+        :param drug_cols: Columns identifying a drug, defaults to DrugResponse.DRUG_COLUMNS.
+        :param feature_col: Column identifying a feature.
+        :param dtype: Data type of the array.
+        :param memmap_file: If not None, the array is created as a memory-mapped .npy file.
+        :return: AssociationCube, drugs and features sorted as in pandas.pivot_table. Duplicated (drug, feature)
+            pairs are averaged as in pandas.pivot_table. Drugs and features are kept even if all their values are
+            missing, see AssociationCube.matrix(dropna=True)
+        """
+        statistics = (
+            [s for s in cls.STATISTICS if s in associations]
+            if statistics is None
+            else statistics
+        )
+
+        d_codes, drugs, f_codes, features = cls.association_codes(
+            associations, drug_cols=drug_cols, feature_col=feature_col
+        )
+
+        values = cls.fill(
+            associations,
+            statistics,
+            (d_codes, len(drugs), f_codes, len(features)),
+            dtype=dtype,
+            memmap_file=memmap_file,
+        )
+
+        return cls(values, drugs, features, statistics)
+
+    @staticmethod
+    def association_codes(associations, drug_cols=None, feature_col="GeneSymbol"):
+        """
+        :return: Tuple of the drug position of each association, drugs, feature position of each association and
+            features
+        """
+        drug_cols = DrugResponse.DRUG_COLUMNS if drug_cols is None else drug_cols
+        drug_cols = [drug_cols] if isinstance(drug_cols, str) else list(drug_cols)
+
+        groups = associations.groupby(drug_cols, sort=True)
+        d_codes, drugs = groups.ngroup().values, groups.size().index
+
+        f_codes, features = pd.factorize(associations[feature_col], sort=True)
+        features = pd.Index(features, name=feature_col)
+
+        return d_codes, drugs, f_codes, features
+
+    @staticmethod
+    def fill(associations, statistics, codes, dtype=np.float64, memmap_file=None):
+        """
+        :param codes: Tuple of the drug position of each association, number of drugs, feature position of each
+            association and number of features.
+        :return: numpy array (statistics x drugs x features)
+        """
+        d_codes, n_drugs, f_codes, n_features = codes
+
+        # Associations with missing drug or feature labels are not stored, as in pandas.pivot_table
+        tested = (d_codes >= 0) & (f_codes >= 0)
+
+        cells = d_codes[tested] * n_features + f_codes[tested]
+
+        duplicated = (len(cells) > 0) and (
+            np.bincount(cells, minlength=n_drugs * n_features).max() > 1
+        )
+
+        shape = (len(statistics), n_drugs, n_features)
+
+        if memmap_file is None:
+            values = np.full(shape, np.nan, dtype=dtype)
+
+        else:
+            values = np.lib.format.open_memmap(
+                memmap_file, mode="w+", dtype=dtype, shape=shape
+            )
+            values[:] = np.nan
+
+        for i, s in enumerate(statistics):
+            s_values = associations[s].values[tested].astype(np.float64)
+
+            if not duplicated:
+                values[i, d_codes[tested], f_codes[tested]] = s_values
+                continue
+
+            # Mean of the non-missing values of each (drug, feature), as pandas.pivot_table
+            valid = ~np.isnan(s_values)
+
+            counts = np.bincount(cells[valid], minlength=n_drugs * n_features)
+            sums = np.bincount(
+                cells[valid], weights=s_values[valid], minlength=n_drugs * n_features
+            )
+
+            with np.errstate(invalid="ignore"):
+                values[i] = (sums / counts).reshape(n_drugs, n_features)
+
+        return values
+
+    @classmethod
+    def of(cls, associations, statistic, drug_cols=None, feature_col="GeneSymbol"):
+        """
+        Cube of the associations data-frame including statistic, cached while the data-frame is alive. Statistics
+        are added to the cached cube as they are requested. Data-frames are assumed not to be modified in place.
+
+        """
+        drug_cols = DrugResponse.DRUG_COLUMNS if drug_cols is None else drug_cols
+        drug_cols = [drug_cols] if isinstance(drug_cols, str) else list(drug_cols)
+
+        key = (id(associations), tuple(drug_cols), feature_col)
+        ref, cube, codes = cls._cache.get(key, (None, None, None))
+
+        if (ref is None) or (ref() is not associations):
+            d_codes, drugs, f_codes, features = cls.association_codes(
+                associations, drug_cols=drug_cols, feature_col=feature_col
+            )
+            codes = (d_codes, len(drugs), f_codes, len(features))
+
+            cube = cls(
+                cls.fill(associations, [statistic], codes), drugs, features, [statistic]
+            )
+
+            if ref is None:
+                weakref.finalize(associations, cls._cache.pop, key, None)
+
+            cls._cache[key] = (weakref.ref(associations), cube, codes)
+
+        elif statistic not in cube.statistics:
+            # Views returned before keep referencing the previous array
+            cube.values = np.concatenate(
+                [cube.values, cls.fill(associations, [statistic], codes)]
+            )
+            cube.statistics.append(statistic)
+
+        # Shared by all callers, views are read-only
+        cube.values.flags.writeable = False
+
+        return cube
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+
+        np.save(os.path.join(path, self.VALUES_FILE), self.values)
+
+        with open(os.path.join(path, self.LABELS_FILE), "wb") as f:
+            pickle.dump((self.drugs, self.features, self.statistics), f)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """
+        :param mmap_mode: numpy.load memory-map mode, None reads the array into memory.
+        """
+        values = np.load(os.path.join(path, cls.VALUES_FILE), mmap_mode=mmap_mode)
+
+        with open(os.path.join(path, cls.LABELS_FILE), "rb") as f:
+            drugs, features, statistics = pickle.load(f)
+
+        return cls(values, drugs, features, statistics)
+
+    def matrix(self, statistic="beta", dropna=False):
+        """
+        :param dropna: Drop drugs and features without values, as pandas.pivot_table.
+        :return: pandas DataFrame (drugs x features), view of the cube unless drugs or features are dropped
+        """
+        values = self.values[self.statistics.index(statistic)]
+        drugs, features = self.drugs, self.features
+
+        if dropna:
+            tested = ~np.isnan(values)
+            rows, columns = tested.any(1), tested.any(0)
+
+            if not (rows.all() and columns.all()):
+                values = values[np.ix_(rows, columns)]
+                drugs, features = drugs[rows], features[columns]
+
+        return pd.DataFrame(values, index=drugs, columns=features, copy=False)
+
+    def drug(self, drug, statistic="beta"):
+        """
+        :param drug: Drug label, e.g. (DRUG_ID, DRUG_NAME, VERSION).
+        :return: pandas Series of the features, view of the cube
+        """
+        return pd.Series(
+            self.values[self.statistics.index(statistic), self.drugs.get_loc(drug)],
+            index=self.features,
+            name=drug,
+            copy=False,
+        )
+
+    def feature(self, feature, statistic="beta"):
+        """
+        :param feature: Feature label, e.g. gene symbol.
+        :return: pandas Series of the drugs, view of the cube
+        """
+        return pd.Series(
+            self.values[
+                self.statistics.index(statistic), :, self.features.get_loc(feature)
+            ],
+            index=self.drugs,
+            name=feature,
+            copy=False,
+        )
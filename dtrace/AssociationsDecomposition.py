@@ -8,6 +8,7 @@ import matplotlib.pyplot as plt
 from sklearn.manifold import TSNE
 from dtrace.DTracePlot import DTracePlot
 from dtrace.DataImporter import DrugResponse
+from dtrace.AssociationsCube import AssociationCube
 from sklearn.preprocessing import StandardScaler
 
 
@@ -40,7 +41,7 @@ class SingleLMMTSNE:
         self.n_iter = n_iter
         self.fdr = fdr
 
-        self.dtargets = DrugResponse().get_drugtargets()
+        self.dtargets = DrugResponse.get_drugtargets()
 
         self.tsnes = self.drug_betas_tsne(lmm_dsingle)
 
@@ -51,12 +52,7 @@ class SingleLMMTSNE:
         drugs_screen = {v: {d for d in drugs if d[2] == v} for v in ["GDSC1", "GDSC2"]}
 
         # Build drug association beta matrix
-        betas = pd.pivot_table(
-            lmm_dsingle,
-            index=DrugResponse.DRUG_COLUMNS,
-            columns="GeneSymbol",
-            values="beta",
-        )
+        betas = AssociationCube.of(lmm_dsingle, "beta").matrix("beta", dropna=True)
         betas = betas.loc[list(drugs)]
 
         # TSNE
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# Copyright (C) 2019 Emanuel Goncalves
+
+import weakref
+import numpy as np
+import pandas as pd
+
+
+class AssociationIndex:
+    """
+    Row index of an associations data-frame used by Association.by and Association.get_association. Key columns
+    (drug, gene, target, feature) are factorised into integer codes with the rows of each value grouped together,
+    and range columns (fdr, pval) keep the row positions ordered by their values, so that point lookups and
+    threshold filters return row positions without scanning or copying the table. The table itself is not reordered
+    and selections are returned in table order. Columns are indexed lazily, the first time they are queried.
+
+    Indexes are cached per data-frame (see AssociationIndex.of) and dropped when the data-frame is garbage
+    collected. Data-frames are assumed not to be modified in place once indexed.
+
+    """
+
+    KEY_COLS = dict(
+        drug_id="DRUG_ID",
+        drug_name="DRUG_NAME",
+        drug_version="VERSION",
+        gene_name="GeneSymbol",
+        target="target",
+        x_feature="x_feature",
+    )
+
+    RANGE_COLS = dict(fdr="fdr", pval="pval")
+
+    # Smaller data-frames are filtered with boolean masks, faster than building the index
+    MIN_ROWS = 10000
+
+    _cache = {}
+
+    def __init__(self, associations):
+        self.n = associations.shape[0]
+        self.associations = weakref.ref(associations)
+
+        self.keys = {}
+        self.ranges = {}
+
+    @classmethod
+    def of(cls, associations):
+        """
+        Cached index of associations, built on first use. None if the data-frame has less than MIN_ROWS rows.
+
+        """
+        if associations.shape[0] < cls.MIN_ROWS:
+            return None
+
+        key = id(associations)
+        index = cls._cache.get(key)
+
+        if (
+            (index is None)
+            or (index.associations() is not associations)
+            or (index.n != associations.shape[0])
+        ):
+            index = cls(associations)
+            cls._cache[key] = index
+            weakref.finalize(associations, cls._cache.pop, key, None)
+
+        return index
+
+    def key_index(self, column):
+        if column not in self.keys:
+            codes, uniques = pd.factorize(self.associations()[column])
+
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+
+            lookup = dict(zip(uniques, range(len(uniques))))
+
+            self.keys[column] = (codes, order, bounds, lookup)
+
+        return self.keys[column]
+
+    def range_index(self, column):
+        if column not in self.ranges:
+            values = np.asarray(self.associations()[column], dtype=np.float64)
+
+            order = np.argsort(values, kind="stable")
+            n_valid = np.count_nonzero(~np.isnan(values))
+
+            self.ranges[column] = (values, order, values[order][:n_valid])
+
+        return self.ranges[column]
+
+    def key_codes(self, column, values):
+        values = list(values) if type(values) in [list, set] else [values]
+
+        lookup = self.key_index(column)[3]
+
+        return np.unique([lookup[v] for v in values if v in lookup]).astype(np.int64)
+
+    def select(self, **kwargs):
+        """
+        Row positions matching all the conditions, same arguments as Association.by.
+
+        :return: Sorted array of row positions, None if there are no conditions
+        """
+        keys = {
+            self.KEY_COLS[k]: self.key_codes(self.KEY_COLS[k], v)
+            for k, v in kwargs.items()
+            if (k in self.KEY_COLS) and (v is not None)
+        }
+
+        ranges = {
+            self.RANGE_COLS[k]: (v, kwargs.get(f"{k}_reverse", False))
+            for k, v in kwargs.items()
+            if (k in self.RANGE_COLS) and (v is not None)
+        }
+
+        if (len(keys) == 0) and (len(ranges) == 0):
+            return None
+
+        # Start from the most selective key, the remaining conditions are checked on its rows only
+        if len(keys) > 0:
+            sizes = {
+                c: (self.key_index(c)[2][codes + 1] - self.key_index(c)[2][codes]).sum()
+                for c, codes in keys.items()
+            }
+
+            c = min(sizes, key=sizes.get)
+            _, order, bounds, _ = self.key_index(c)
+
+            pos = np.concatenate(
+                [order[bounds[i] : bounds[i + 1]] for i in keys.pop(c)] + [[]]
+            ).astype(np.int64)
+
+        else:
+            c, (thres, reverse) = ranges.popitem()
+            _, order, values_sorted = self.range_index(c)
+
+            idx = np.searchsorted(values_sorted, thres, side="left")
+            pos = order[idx : len(values_sorted)] if reverse else order[:idx]
+
+        for c, codes in keys.items():
+            pos = pos[np.isin(self.key_index(c)[0][pos], codes)]
+
+        for c, (thres, reverse) in ranges.items():
+            values = self.range_index(c)[0][pos]
+            pos = pos[(values >= thres) if reverse else (values < thres)]
+
+        # Large selections are put back in table order with a mask, faster than sorting
+        if len(pos) > (self.n // 16):
+            mask = np.zeros(self.n, dtype=bool)
+            mask[pos] = True
+            return np.flatnonzero(mask)
+
+        return np.sort(pos)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# Copyright (C) 2019 Emanuel Goncalves
+
+import os
+import pickle
+import igraph
+import logging
+import numpy as np
+import pandas as pd
+from dtrace.Associations import Association
+from dtrace.DataImporter import DrugResponse, PPI
+from dtrace.LMMEngine import KinshipCache, KinshipFactor
+
+
+class AssociationScorer:
+    """
+    Scores the associations of a new drug response vector (e.g. a compound just screened) against all features
+    without building an Association object. The features (e.g. scaled CRISPR matrix), covariates, kinship and its
+    eigendecomposition, drug targets and PPI network are prepared once (AssociationScorer.from_association) and kept
+    in memory, or saved to a directory and memory-mapped (AssociationScorer.save and AssociationScorer.load).
+
+    Drugs are fitted with the native engine (dtrace.LMMEngine) and returned with the same columns and annotations as
+    Association.lmm_single_associations.
+
+    """
+
+    X_FILE = "x.npy"
+    K_FILE = "k.npy"
+    K_U_FILE = "k_u.npy"
+    K_S_FILE = "k_s.npy"
+    QS_Q_FILE = "qs_q.npy"
+    QS_S_FILE = "qs_s.npy"
+    LABELS_FILE = "labels.pkl"
+    PPI_FILE = "ppi.pkl"
+
+    def __init__(
+        self,
+        x,
+        m=None,
+        k=None,
+        x_dtype="crispr",
+        pval_method="fdr_bh",
+        drug_targets=None,
+        ppi=None,
+        target_thres=5,
+        kinship_cache_size=8,
+        qs=None,
+    ):
+        """
+        :param x: Features (samples x features), e.g. Association.crispr transposed.
+        :param m: Optional covariates (samples x covariates).
+        :param k: Optional kinship (samples x samples data-frame or KinshipFactor).
+        :param x_dtype: Type of features, as in Association.lmm_single_associations.
+        :param pval_method: Multiple hypothesis adjustment method (statsmodels.stats.multitest.multipletests).
+        :param drug_targets: Dictionary of DRUG_ID -> set of targets, defaults to DrugResponse.get_drugtargets().
+        :param ppi: Optional network (igraph.Graph, e.g. PPI.build_string_ppi) used to annotate the distance between
+            the drug targets and the features. Not used for genomic features.
+        :param qs: Optional eigendecomposition of k over all samples (see LMMEngine.economic_qs), computed if None.
+
+        """
+        self.x = x
+        self.m = m
+        self.k = k
+        self.x_dtype = x_dtype
+        self.pval_method = pval_method
+        self.target_thres = target_thres
+        self.ppi = ppi
+
+        self.drug_targets = (
+            DrugResponse.get_drugtargets() if drug_targets is None else drug_targets
+        )
+
+        # Decomposition of all the samples, drugs with missing measurements are decomposed and cached on demand
+        self.kinship_cache = (
+            None if k is None else KinshipCache(k, maxsize=kinship_cache_size)
+        )
+
+        if self.kinship_cache is not None:
+            if qs is None:
+                self.kinship_cache.get(self.x.index)
+
+            else:
+                self.kinship_cache.put(self.x.index, qs)
+
+    @classmethod
+    def from_association(
+        cls,
+        assoc,
+        x_dtype="crispr",
+        add_covariates=True,
+        add_random_effects=True,
+        low_rank_kinship=False,
+        kinship_rank=None,
+        ppi_kws=None,
+        **kwargs,
+    ):
+        """
+        Scorer of the data of Association.lmm_single_associations with the same arguments.
+
+        :param assoc: dtrace.Associations.Association
+        :param ppi_kws: Arguments of PPI.build_string_ppi, defaults to the ones of lmm_single_associations.
+        :param kwargs: Extra arguments of AssociationScorer (e.g. kinship_cache_size).
+        """
+        _, x, k, m = assoc.lmm_single_data(
+            x_dtype=x_dtype,
+            add_covariates=add_covariates,
+            add_random_effects=add_random_effects,
+            low_rank_kinship=low_rank_kinship,
+            kinship_rank=kinship_rank,
+        )
+
+        ppi = (
+            None
+            if x_dtype == "genomic"
+            else assoc.ppi.build_string_ppi(
+                **(dict(score_thres=900) if ppi_kws is None else ppi_kws)
+            )
+        )
+
+        return cls(
+            x,
+            m=m,
+            k=k,
+            x_dtype=x_dtype,
+            pval_method=assoc.pval_method,
+            drug_targets=assoc.drespo_obj.get_drugtargets(),
+            ppi=ppi,
+            **kwargs,
+        )
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+
+        np.save(os.path.join(path, self.X_FILE), self.x.values)
+
+        if isinstance(self.k, KinshipFactor):
+            np.save(os.path.join(path, self.K_U_FILE), self.k.u)
+            np.save(os.path.join(path, self.K_S_FILE), self.k.s)
+
+        elif self.k is not None:
+            np.save(os.path.join(path, self.K_FILE), self.k.values)
+
+        if self.kinship_cache is not None:
+            q, s = self.kinship_cache.get(self.x.index)
+            np.save(os.path.join(path, self.QS_Q_FILE), q)
+            np.save(os.path.join(path, self.QS_S_FILE), s)
+
+        if self.ppi is not None:
+            self.ppi.write_pickle(os.path.join(path, self.PPI_FILE))
+
+        labels = dict(
+            samples=self.x.index,
+            features=self.x.columns,
+            m=self.m,
+            k_type=type(self.k).__name__,
+            k_index=None if self.k is None else self.k.index,
+            x_dtype=self.x_dtype,
+            pval_method=self.pval_method,
+            drug_targets=self.drug_targets,
+            target_thres=self.target_thres,
+        )
+
+        with open(os.path.join(path, self.LABELS_FILE), "wb") as f:
+            pickle.dump(labels, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r", kinship_cache_size=8):
+        """
+        :param mmap_mode: numpy.load memory-map mode of the features, kinship and its decomposition, None reads
+            them into memory.
+        """
+        with open(os.path.join(path, cls.LABELS_FILE), "rb") as f:
+            labels = pickle.load(f)
+
+        x = pd.DataFrame(
+            np.load(os.path.join(path, cls.X_FILE), mmap_mode=mmap_mode),
+            index=labels["samples"],
+            columns=labels["features"],
+            copy=False,
+        )
+
+        if labels["k_type"] == "KinshipFactor":
+            k = KinshipFactor(
+                np.load(os.path.join(path, cls.K_U_FILE), mmap_mode=mmap_mode),
+                np.load(os.path.join(path, cls.K_S_FILE), mmap_mode=mmap_mode),
+                labels["k_index"],
+            )
+
+        elif labels["k_type"] == "DataFrame":
+            k = pd.DataFrame(
+                np.load(os.path.join(path, cls.K_FILE), mmap_mode=mmap_mode),
+                index=labels["k_index"],
+                columns=labels["k_index"],
+                copy=False,
+            )
+
+        else:
+            k = None
+
+        qs = (
+            None
+            if k is None
+            else (
+                np.load(os.path.join(path, cls.QS_Q_FILE), mmap_mode=mmap_mode),
+                np.load(os.path.join(path, cls.QS_S_FILE), mmap_mode=mmap_mode),
+            )
+        )
+
+        ppi_file = os.path.join(path, cls.PPI_FILE)
+        ppi = igraph.Graph.Read_Pickle(ppi_file) if os.path.exists(ppi_file) else None
+
+        return cls(
+            x,
+            m=labels["m"],
+            k=k,
+            x_dtype=labels["x_dtype"],
+            pval_method=labels["pval_method"],
+            drug_targets=labels["drug_targets"],
+            ppi=ppi,
+            target_thres=labels["target_thres"],
+            kinship_cache_size=kinship_cache_size,
+            qs=qs,
+        )
+
+    def score(self, drug_response, drug_id=None, targets=None, verbose=0):
+        """
+        :param drug_response: pandas Series of the drug response (e.g. IC50) per sample, samples without features
+            are ignored. The Series name, if a (DRUG_ID, DRUG_NAME, VERSION) tuple, labels the associations.
+        :param drug_id: Optional drug label, defaults to the name of drug_response.
+        :param targets: Optional set of targets of the drug, defaults to the targets of its DRUG_ID.
+        :return: pandas DataFrame of the associations, sorted by fdr and pval
+        """
+        drug_id = drug_response.name if drug_id is None else drug_id
+        drug_id = (
+            tuple(drug_id)
+            if isinstance(drug_id, (tuple, list))
+            else (drug_id, drug_id, None)
+        )
+
+        if verbose:
+            logging.getLogger("DTrace").info(
+                f"[AssociationScorer] Drug {drug_id[1]} from screen {drug_id[2]} with ID {drug_id[0]}"
+            )
+
+        y = drug_response.reindex(self.x.index).to_frame(name=drug_id)
+
+        res, params = Association.lmm_association_native(
+            y=y,
+            x=self.x,
+            m=self.m,
+            k=self.k,
+            transform_x="scale" if self.x_dtype != "genomic" else "min_events",
+            kinship_cache=self.kinship_cache,
+        )
+
+        res = Association.lmm_association_format(res, drug_id, params)
+
+        res = Association.multipletests_per_drug(res, method=self.pval_method)
+
+        # Annotate drug target
+        d_targets = (
+            self.drug_targets.get(drug_id[0], set())
+            if targets is None
+            else set(targets)
+        )
+
+        res["DRUG_TARGETS"] = ";".join(d_targets) if len(d_targets) > 0 else np.nan
+
+        # Annotate association distance to target
+        if (self.x_dtype != "genomic") and (self.ppi is not None):
+            res = PPI(
+                drug_targets={drug_id[0]: d_targets} if len(d_targets) > 0 else {}
+            ).ppi_annotation(
+                res,
+                ppi_type="string",
+                ppi_kws=None,
+                target_thres=self.target_thres,
+                ppi=self.ppi,
+            )
+
+        # X data type
+        res = res.assign(x_dtype=self.x_dtype)
+
+        return res.sort_values(["fdr", "pval"])
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# Copyright (C) 2019 Emanuel Goncalves
+
+import os
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class AssociationStore:
+    """
+    Columnar store of association tables: Parquet files partitioned by drug (VERSION=.../DRUG_ID=.../) with
+    dictionary encoded string columns (e.g. GeneSymbol, DRUG_NAME) and single precision effect sizes. Tables are
+    written one drug at a time and can be read back selecting only the columns and drugs needed.
+
+    P-values and FDRs are kept in double precision, single precision underflows below ~1e-38 which would tie the most
+    significant associations.
+
+    Label and annotation columns (AssociationStore.STRING_COLUMNS) are always stored as strings, and columns missing
+    for every association of a drug take the type they already have in the store, so that all partitions share the
+    same schema.
+
+    """
+
+    PARTITION_COLS = ["VERSION", "DRUG_ID"]
+    PART_FILE = "part-0.parquet"
+    COLUMNS_KEY = b"dtrace.columns"
+    ATTRS_KEY = b"dtrace.attrs"
+
+    STRING_COLUMNS = [
+        "GeneSymbol",
+        "DRUG_NAME",
+        "DRUG_TARGETS",
+        "target_detailed",
+        "target",
+        "x_feature",
+        "x_dtype",
+        "pval_source",
+    ]
+
+    def __init__(self, path, partition_cols=None):
+        """
+        :param path: Directory of the store. Created when first written.
+        :param partition_cols: Columns defining the partitions, defaults to AssociationStore.PARTITION_COLS.
+
+        """
+        self.path = path
+        self.partition_cols = (
+            self.PARTITION_COLS if partition_cols is None else partition_cols
+        )
+
+        self._schema = None
+
+    def exists(self):
+        return os.path.isdir(self.path)
+
+    def schema(self):
+        """
+        Arrow schema of the partitions (without the partition columns), None if the store is empty.
+
+        """
+        if self._schema is None:
+            p_files = self.partition_files() if self.exists() else []
+            self._schema = pq.read_schema(p_files[0]) if len(p_files) > 0 else None
+
+        return self._schema
+
+    def partition_dir(self, key):
+        key = key if type(key) == tuple else (key,)
+        return os.path.join(
+            self.path, *[f"{c}={v}" for c, v in zip(self.partition_cols, key)]
+        )
+
+    @staticmethod
+    def is_pvalue(column):
+        return ("pval" in column) or ("fdr" in column)
+
+    @classmethod
+    def arrow_type(cls, column, dtype):
+        if column in cls.STRING_COLUMNS:
+            return pa.dictionary(pa.int32(), pa.string())
+
+        if pd.api.types.is_float_dtype(dtype):
+            return pa.float64() if cls.is_pvalue(column) else pa.float32()
+
+        if pd.api.types.is_bool_dtype(dtype):
+            return pa.bool_()
+
+        if pd.api.types.is_integer_dtype(dtype):
+            return pa.int64()
+
+        return pa.dictionary(pa.int32(), pa.string())
+
+    @classmethod
+    def to_table(cls, associations, schema=None):
+        """
+        Arrow table with a schema derived from the column names and dtypes, such that all partitions share the same
+        schema, e.g. DRUG_TARGETS missing for every association of a drug (float NaNs) is still a string column.
+
+        :param schema: Optional schema of the partitions already written, used for the columns missing in every
+            association.
+        """
+        df = associations.reset_index(drop=True)
+
+        types = {c: cls.arrow_type(c, df[c].dtype) for c in df.columns}
+
+        if schema is not None:
+            for c in df.columns:
+                if (c in schema.names) and df[c].isna().all():
+                    types[c] = schema.field(c).type
+
+        schema = pa.schema([pa.field(c, types[c]) for c in df.columns])
+
+        for c, t in zip(df.columns, schema.types):
+            if pa.types.is_dictionary(t):
+                values = df[c].astype(object)
+                values = values.where(values.isna(), values.astype(str))
+
+                df[c] = pd.Categorical(
+                    values, categories=pd.Index(values.dropna().unique(), dtype=object)
+                )
+
+            elif df[c].isna().all():
+                df[c] = df[c].astype(object)
+
+        return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+    def write(self, associations):
+        """
+        Write associations to the store, one partition (drug) at a time. Partitions already in the store are
+        replaced, others are kept.
+
+        :param associations: Associations data-frame or iterable of data-frames (e.g. the per drug results of
+            Association.lmm_single_association_batch), written as they are consumed.
+        """
+        batches = (
+            [associations] if isinstance(associations, pd.DataFrame) else associations
+        )
+
+        for batch in batches:
+            # Original column order, partition columns are stored in the directory names
+            metadata = {self.COLUMNS_KEY: json.dumps(list(batch.columns)).encode()}
+
+            # Data-frame attributes (e.g. model settings of Association.lmm_single_associations)
+            if len(batch.attrs) > 0:
+                metadata[self.ATTRS_KEY] = json.dumps(batch.attrs).encode()
+
+            for key, df in batch.groupby(self.partition_cols, sort=False):
+                p_dir = self.partition_dir(key)
+                os.makedirs(p_dir, exist_ok=True)
+
+                p_file = os.path.join(p_dir, self.PART_FILE)
+
+                table = self.to_table(
+                    df.drop(columns=self.partition_cols), schema=self.schema()
+                )
+                table = table.replace_schema_metadata(
+                    {**(table.schema.metadata or {}), **metadata}
+                )
+
+                pq.write_table(table, f"{p_file}.tmp")
+                os.replace(f"{p_file}.tmp", p_file)
+
+                if self._schema is None:
+                    self._schema = table.schema
+
+    def columns(self):
+        metadata = pq.read_schema(self.partition_files()[0]).metadata
+        return json.loads(metadata[self.COLUMNS_KEY])
+
+    def attrs(self):
+        metadata = pq.read_schema(self.partition_files()[0]).metadata
+        return (
+            json.loads(metadata[self.ATTRS_KEY]) if self.ATTRS_KEY in metadata else {}
+        )
+
+    def read(self, columns=None, drugs=None, versions=None, as_categorical=False):
+        """
+        :param columns: Columns to load, partition columns are always included. All if None.
+        :param drugs: Optional list of DRUG_IDs to load.
+        :param versions: Optional list of screen versions (VERSION) to load.
+        :param as_categorical: Keep string columns as pandas categoricals instead of objects.
+        :return: pandas DataFrame
+        """
+        filters = []
+
+        if drugs is not None:
+            filters.append(("DRUG_ID", "in", list(drugs)))
+
+        if versions is not None:
+            filters.append(("VERSION", "in", list(versions)))
+
+        if columns is not None:
+            columns = self.partition_cols + [
+                c for c in columns if c not in self.partition_cols
+            ]
+
+        df = pd.read_parquet(
+            self.path,
+            engine="pyarrow",
+            columns=columns,
+            filters=filters if len(filters) > 0 else None,
+        )
+
+        for c in df.columns[df.dtypes == "category"]:
+            categories = df[c].cat.categories
+
+            if pd.api.types.is_integer_dtype(categories.dtype):
+                df[c] = df[c].astype(np.int64)
+
+            elif not as_categorical:
+                df[c] = df[c].astype(object)
+
+        df = df[[c for c in self.columns() if c in df]]
+        df.attrs.update(self.attrs())
+
+        return df
+
+    def to_csv(self, csv_file, sort_cols=None, **kwargs):
+        """
+        Export the store to a CSV file. Partitions are streamed one at a time unless sort_cols is given, in which
+        case the whole table is loaded and sorted.
+
+        :param kwargs: Extra arguments of pandas.DataFrame.to_csv (e.g. compression).
+        """
+        if sort_cols is not None:
+            self.read().sort_values(sort_cols).to_csv(csv_file, index=False, **kwargs)
+            return
+
+        mode = "w"
+
+        for p_file in sorted(self.partition_files()):
+            p_dirs = os.path.relpath(p_file, self.path).split(os.sep)[:-1]
+            key = dict(d.split("=", 1) for d in p_dirs)
+
+            df = pq.read_table(p_file).to_pandas()
+
+            for c in self.partition_cols:
+                df[c] = int(key[c]) if key[c].isdigit() else key[c]
+
+            df = df[json.loads(pq.read_schema(p_file).metadata[self.COLUMNS_KEY])]
+
+            df.to_csv(csv_file, index=False, mode=mode, header=(mode == "w"), **kwargs)
+            mode = "a"
+
+    def partition_files(self):
+        return [
+            os.path.join(root, f)
+            for root, _, files in os.walk(self.path)
+            for f in files
+            if f == self.PART_FILE
+        ]
@@ -1,10 +1,16 @@
 #!/usr/bin/env python
 # Copyright (C) 2019 Emanuel Goncalves
 
+import os
+import json
 import pydot
+import pickle
 import igraph
+import hashlib
 import logging
+import functools
 import warnings
+import threading
 import numpy as np
 import pandas as pd
 import crispy as cy
@@ -43,6 +49,290 @@ class DataPCA:
         return pca
 
 
+class DataFingerprint:
+    """
+    Content hash of data-sets and parameters used to detect which inputs of an analysis changed between runs.
+
+    """
+
+    @staticmethod
+    def hash(*objs):
+        """
+        SHA-1 of the values and labels of pandas/numpy objects and of any JSON serialisable parameters.
+
+        :param objs: pandas DataFrame/Series, numpy arrays, None or JSON serialisable objects.
+        :return: str
+        """
+        sha1 = hashlib.sha1()
+
+        for obj in objs:
+            if isinstance(obj, (pd.DataFrame, pd.Series)):
+                labels = (
+                    list(obj.columns) if isinstance(obj, pd.DataFrame) else obj.name
+                )
+                values = pd.util.hash_pandas_object(obj, index=True).values
+
+                sha1.update(repr(labels).encode())
+                sha1.update(values.tobytes())
+
+            elif isinstance(obj, np.ndarray):
+                sha1.update(repr(obj.shape).encode())
+                sha1.update(np.ascontiguousarray(obj).tobytes())
+
+            else:
+                sha1.update(json.dumps(obj, sort_keys=True, default=str).encode())
+
+        return sha1.hexdigest()
+
+
+class DataCache:
+    """
+    Binary cache of the numeric matrices read from CSV files by the importers. The first read parses the CSV and
+    writes its values as a .npy file together with the row and column labels, later reads memory-map the values
+    (copy-on-write, modifications are not written back) instead of decompressing and parsing the file.
+
+    A cached matrix is reused while the source file keeps the same size and modification time. If only the
+    modification time changed (e.g. the file was checked out again) the cache is reused if the SHA-1 of the file is
+    unchanged.
+
+    Matrices with a single numeric type are memory-mapped without copying. Non-numeric columns (e.g. tissue labels)
+    are stored with the labels, and tables mixing types are assembled column by column. Tables without numeric
+    columns are not cached.
+
+    """
+
+    CACHE_DIR = f"{dpath}/.cache"
+    ENABLED = True
+
+    VALUES_FILE = "values.npy"
+    LABELS_FILE = "labels.pkl"
+    SOURCE_FILE = "source.json"
+
+    @classmethod
+    def cache_dir(cls, filepath, kwargs):
+        key = json.dumps(
+            [os.path.abspath(filepath), kwargs], sort_keys=True, default=str
+        )
+        return os.path.join(cls.CACHE_DIR, hashlib.sha1(key.encode()).hexdigest())
+
+    @staticmethod
+    def file_hash(filepath, chunk_size=2**20):
+        sha1 = hashlib.sha1()
+
+        with open(filepath, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                sha1.update(chunk)
+
+        return sha1.hexdigest()
+
+    @classmethod
+    def is_valid(cls, c_dir, filepath):
+        source_file = os.path.join(c_dir, cls.SOURCE_FILE)
+
+        if not os.path.exists(source_file):
+            return False
+
+        with open(source_file) as f:
+            source = json.load(f)
+
+        stat = os.stat(filepath)
+
+        if stat.st_size != source["size"]:
+            return False
+
+        if stat.st_mtime_ns == source["mtime"]:
+            return True
+
+        if cls.file_hash(filepath) != source["sha1"]:
+            return False
+
+        cls.write_json(source_file, dict(source, mtime=stat.st_mtime_ns))
+
+        return True
+
+    @staticmethod
+    def is_numeric(dtype):
+        return isinstance(dtype, np.dtype) and (dtype.kind in "biuf")
+
+    @classmethod
+    def has_numeric(cls, df):
+        return any(cls.is_numeric(t) for t in df.dtypes)
+
+    @staticmethod
+    def write_json(json_file, obj):
+        with open(f"{json_file}.tmp", "w") as f:
+            json.dump(obj, f)
+
+        os.replace(f"{json_file}.tmp", json_file)
+
+    @classmethod
+    def save(cls, c_dir, filepath, df):
+        os.makedirs(c_dir, exist_ok=True)
+
+        # Invalidate first, the cache is only valid again once all files are written
+        source_file = os.path.join(c_dir, cls.SOURCE_FILE)
+        if os.path.exists(source_file):
+            os.remove(source_file)
+
+        stat = os.stat(filepath)
+
+        cls.write_frame(c_dir, df)
+
+        cls.write_json(
+            source_file,
+            dict(
+                size=stat.st_size, mtime=stat.st_mtime_ns, sha1=cls.file_hash(filepath)
+            ),
+        )
+
+    @classmethod
+    def write_frame(cls, c_dir, df):
+        os.makedirs(c_dir, exist_ok=True)
+
+        # Labels are written last, a frame is only readable once complete
+        labels_file = os.path.join(c_dir, cls.LABELS_FILE)
+        if os.path.exists(labels_file):
+            os.remove(labels_file)
+
+        dtypes = list(df.dtypes)
+        numeric = [i for i, t in enumerate(dtypes) if cls.is_numeric(t)]
+        others = {
+            i: df.iloc[:, i].values for i in range(len(dtypes)) if i not in numeric
+        }
+
+        values_file = os.path.join(c_dir, cls.VALUES_FILE)
+        with open(f"{values_file}.tmp", "wb") as f:
+            np.save(f, df.iloc[:, numeric].values)
+        os.replace(f"{values_file}.tmp", values_file)
+
+        with open(f"{labels_file}.tmp", "wb") as f:
+            pickle.dump((df.index, df.columns, dtypes, numeric, others), f)
+        os.replace(f"{labels_file}.tmp", labels_file)
+
+    @classmethod
+    def get_frame(cls, name):
+        """
+        Frame stored by put_frame (e.g. data derived from the importers' matrices), None if not cached.
+
+        """
+        c_dir = os.path.join(cls.CACHE_DIR, name)
+
+        if not (cls.ENABLED and os.path.exists(os.path.join(c_dir, cls.LABELS_FILE))):
+            return None
+
+        return cls.load(c_dir)
+
+    @classmethod
+    def put_frame(cls, name, df):
+        if not (cls.ENABLED and cls.has_numeric(df)):
+            return
+
+        try:
+            cls.write_frame(os.path.join(cls.CACHE_DIR, name), df)
+
+        except OSError as e:
+            logging.getLogger("DTrace").warning(
+                f"DataCache not written for {name}: {e}"
+            )
+
+    @classmethod
+    def load(cls, c_dir):
+        with open(os.path.join(c_dir, cls.LABELS_FILE), "rb") as f:
+            index, columns, dtypes, numeric, others = pickle.load(f)
+
+        # Object arrays can't be memory-mapped, frames without numeric columns are built from the labels only
+        values = (
+            np.load(os.path.join(c_dir, cls.VALUES_FILE), mmap_mode="c")
+            if len(numeric) > 0
+            else None
+        )
+
+        if (len(others) == 0) and (len(set(dtypes)) <= 1):
+            return pd.DataFrame(values, index=index, columns=columns, copy=False)
+
+        # Numeric columns of mixed types (e.g. integers and floats with missing values) are stored in their common
+        # type and cast back
+        df = {i: values[:, j].astype(dtypes[i]) for j, i in enumerate(numeric)}
+        df.update(others)
+
+        df = pd.DataFrame({i: df[i] for i in range(len(dtypes))}, index=index)
+        df.columns = columns
+
+        return df
+
+    @classmethod
+    def read_csv(cls, filepath, **kwargs):
+        """
+        Same as pandas.read_csv(filepath, **kwargs), served from the cache when valid.
+
+        """
+        if not cls.ENABLED:
+            return pd.read_csv(filepath, **kwargs)
+
+        c_dir = cls.cache_dir(filepath, kwargs)
+
+        if cls.is_valid(c_dir, filepath):
+            return cls.load(c_dir)
+
+        df = pd.read_csv(filepath, **kwargs)
+
+        if not cls.has_numeric(df):
+            return df
+
+        try:
+            cls.save(c_dir, filepath, df)
+
+        except OSError as e:
+            logging.getLogger("DTrace").warning(
+                f"DataCache not written for {filepath}: {e}"
+            )
+
+        return df
+
+
+class DataRegistry:
+    """
+    Process-wide registry of importer objects and parsed files (e.g. Sample, DrugResponse and the drugsheet) shared
+    by all callers, so that each source is parsed once per process and repeated requests are served from memory.
+    Objects are built on their first request. Threads requesting an object under construction wait for it instead
+    of building it again.
+
+    Registered objects are shared and must not be modified in place.
+
+    """
+
+    _objects = {}
+    _locks = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, factory, *args, **kwargs):
+        """
+        :param factory: Callable building the object, e.g. an importer class.
+        :param args: Hashable arguments of factory, part of the key of the object together with factory.
+        :return: factory(*args, **kwargs), built once per process
+        """
+        key = (factory, args, tuple(sorted(kwargs.items())))
+
+        if key in cls._objects:
+            return cls._objects[key]
+
+        with cls._lock:
+            lock = cls._locks.setdefault(key, threading.Lock())
+
+        with lock:
+            if key not in cls._objects:
+                cls._objects[key] = factory(*args, **kwargs)
+
+        return cls._objects[key]
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._objects.clear()
+            cls._locks.clear()
+
+
 class Sample:
     """
     Import module that handles the sample list (i.e. list of cell lines) and their descriptive information.
@@ -121,10 +411,10 @@ class DrugResponse:
         self.drugsheet = self.get_drugsheet()
 
         # Import and Merge drug response matrix (IC50)
-        self.drugresponse = pd.read_csv(f"{dpath}/{self.drugresponse_file}", index_col=[0, 1, 2])
+        self.drugresponse = DataCache.read_csv(f"{dpath}/{self.drugresponse_file}", index_col=[0, 1, 2])
 
         # Drug max concentration
-        self.maxconcentration = pd.read_csv(f"{dpath}/{self.drugmaxconcentration_file}", index_col=[0, 1, 2]).iloc[:, 0]
+        self.maxconcentration = DataCache.read_csv(f"{dpath}/{self.drugmaxconcentration_file}", index_col=[0, 1, 2]).iloc[:, 0]
 
     def perform_pca(self, n_components=10, subset=None):
         df = DataPCA.perform_pca(
@@ -153,7 +443,7 @@ class DrugResponse:
         return pca
 
     def perform_growth_corr(self, subset=None):
-        ss = Sample()
+        ss = DataRegistry.get(Sample)
 
         corr = ss.growth_corr(self.filter(subset=subset))
         corr.round(5).to_csv(
@@ -180,10 +470,17 @@ class DrugResponse:
 
     @staticmethod
     def get_drugsheet(drugsheet_file="meta/DrugSheet_20191106.csv"):
-        return pd.read_csv(f"{dpath}/{drugsheet_file}", index_col=0)
+        return DataRegistry.get(
+            pd.read_csv, f"{dpath}/{drugsheet_file}", index_col=0
+        ).copy()
 
     @classmethod
     def get_drugtargets(cls, by="id"):
+        d_targets = DataRegistry.get(cls.build_drugtargets, by)
+        return {k: set(v) for k, v in d_targets.items()}
+
+    @classmethod
+    def build_drugtargets(cls, by="id"):
         if by == "id":
             d_targets = cls.get_drugsheet()["Gene Target"].dropna().to_dict()
 
@@ -200,8 +497,14 @@ class DrugResponse:
 
         return d_targets
 
-    def get_data(self):
-        return self.drugresponse.copy()
+    def get_data(self, copy=True):
+        """
+        :param copy: If False the matrix is returned without copying its values (shallow copy), read-only use
+            only: before pandas copy-on-write (pandas 3) modifying it in place changes the data of the importer,
+            which is shared by all its users (see DataRegistry). Filters (e.g. DrugResponse.filter) return
+            independent frames of the selected rows and columns.
+        """
+        return self.drugresponse.copy(deep=copy)
 
     def filter(
         self,
@@ -213,7 +516,7 @@ class DrugResponse:
         filter_combinations=True,
     ):
         # Drug max screened concentration
-        df = self.get_data()
+        df = self.get_data(copy=False)
         d_maxc = np.log(self.maxconcentration * max_c)
 
         # - Filters
@@ -222,17 +525,17 @@ class DrugResponse:
             df = df.loc[:, df.columns.isin(subset)]
 
         # Filter by mininum number of observations
-        df = df[df.count(1) > (df.shape[1] * min_meas)]
+        rows = df.count(1).values > (df.shape[1] * min_meas)
 
         # Filter by max screened concentration
         if filter_max_concentration:
-            df = df[[sum(df.loc[i] < d_maxc.loc[i]) >= min_events for i in df.index]]
+            rows &= df.lt(d_maxc.reindex(df.index), axis=0).sum(1).values >= min_events
 
         # Filter combinations
         if filter_combinations:
-            df = df[[" + " not in i[1] for i in df.index]]
+            rows &= np.array([" + " not in i[1] for i in df.index], dtype=bool)
 
-        return self.get_data().loc[df.index, df.columns]
+        return df[rows]
 
     def is_in_druglist(self, drug_ids):
         return np.all([d in self.drugsheet.index for d in drug_ids])
@@ -291,7 +594,7 @@ class CRISPR:
         fc_file="crispr/CRISPR_corrected_qnorm_20191108.csv.gz",
         institute_file="crispr/CRISPR_Institute_Origin_20191108.csv.gz",
     ):
-        self.crispr = pd.read_csv(f"{dpath}/{fc_file}", index_col=0)
+        self.crispr = DataCache.read_csv(f"{dpath}/{fc_file}", index_col=0)
         self.institute = pd.read_csv(f"{dpath}/{institute_file}", index_col=0, header=None).iloc[:, 0]
 
     def perform_pca(self, n_components=10, subset=None):
@@ -314,7 +617,7 @@ class CRISPR:
         return pca
 
     def perform_growth_corr(self, subset=None):
-        ss = Sample()
+        ss = DataRegistry.get(Sample)
 
         corr = ss.growth_corr(self.filter(subset=subset))
         corr.round(5).to_csv(f"{dpath}/growth_CRISPR_correlation.csv", index=False)
@@ -331,13 +634,18 @@ class CRISPR:
 
         return num_resp
 
-    def get_data(self, scale=True):
-        df = self.crispr.copy()
+    def get_data(self, scale=True, copy=True):
+        df = self.scaled if scale else self.crispr
+        return df.copy(deep=copy)
 
-        if scale:
-            df = self.scale(df)
+    @functools.cached_property
+    def scaled(self):
+        """
+        Fold-changes scaled by the essential and non-essential genes (CRISPR.scale), computed once and kept in the
+        binary cache (see CRISPR.scale_cached).
 
-        return df
+        """
+        return self.scale_cached(self.crispr)
 
     def filter(
         self,
@@ -348,29 +656,39 @@ class CRISPR:
         min_events=5,
         drop_core_essential_broad=False,
     ):
-        df = self.get_data(scale=True)
+        df = self.get_data(scale=scale, copy=False)
 
         # - Filters
         # Subset matrices
-        if subset is not None:
-            df = df.loc[:, df.columns.isin(subset)]
+        columns = (
+            np.ones(df.shape[1], dtype=bool)
+            if subset is None
+            else df.columns.isin(subset)
+        )
+
+        rows = np.ones(df.shape[0], dtype=bool)
 
         # Filter by scaled scores
         if abs_thres is not None:
-            df = df[(df.abs() > abs_thres).sum(1) >= min_events]
+            df_scaled = self.get_data(scale=True, copy=False).loc[:, columns]
+            rows &= (df_scaled.abs() > abs_thres).sum(1).values >= min_events
 
         # Filter out core essential genes
         if drop_core_essential:
-            df = df[~df.index.isin(cy.Utils.get_adam_core_essential())]
+            rows &= ~df.index.isin(cy.Utils.get_adam_core_essential())
 
         if drop_core_essential_broad:
-            df = df[~df.index.isin(cy.Utils.get_broad_core_essential())]
+            rows &= ~df.index.isin(cy.Utils.get_broad_core_essential())
 
         # - Subset matrices
-        return self.get_data(scale=scale).loc[df.index].reindex(columns=df.columns)
+        return df.loc[rows, columns]
 
     @staticmethod
-    def scale(df, essential=None, non_essential=None, metric=np.median):
+    def scale_metrics(df, essential=None, non_essential=None, metric=np.median):
+        """
+        :return: pandas DataFrame (samples x [essential, non_essential]) of the metric of the essential and
+            non-essential genes in each sample
+        """
         if essential is None:
             essential = cy.Utils.get_essential_genes(return_series=False)
 
@@ -385,14 +703,101 @@ class CRISPR:
             len(non_essential.intersection(df.index)) != 0
         ), "DataFrame has no index overlapping with non essential list"
 
-        essential_metric = metric(df.reindex(essential).dropna(), axis=0)
-        non_essential_metric = metric(df.reindex(non_essential).dropna(), axis=0)
+        return pd.DataFrame(
+            dict(
+                essential=metric(df.reindex(essential).dropna(), axis=0),
+                non_essential=metric(df.reindex(non_essential).dropna(), axis=0),
+            ),
+            index=df.columns,
+        )
+
+    @classmethod
+    def scale(
+        cls, df, essential=None, non_essential=None, metric=np.median, metrics=None
+    ):
+        """
+        :param metrics: Optional per sample metrics of df (see CRISPR.scale_metrics), computed if None.
+        """
+        if metrics is None:
+            metrics = cls.scale_metrics(df, essential, non_essential, metric)
+
+        # Single output matrix, divided in place
+        values = df.values - metrics["non_essential"].values
+        values /= (metrics["non_essential"] - metrics["essential"]).values
 
-        df = df.subtract(non_essential_metric).divide(
-            non_essential_metric - essential_metric
+        return pd.DataFrame(values, index=df.index, columns=df.columns, copy=False)
+
+    @classmethod
+    def scale_cached(cls, df, name="crispr_scale"):
+        """
+        Same as CRISPR.scale(df), with the per sample metrics and scaled fold-changes kept in the binary cache
+        (DataCache.put_frame). Samples are matched to the cache by the hash of their fold-changes: samples appended
+        or changed since the cache was written are the only ones scaled, the others are memory-mapped from the
+        cache. Scaling is independent per sample, so results are the same as scaling the whole matrix.
+
+        """
+        essential = cy.Utils.get_essential_genes(return_series=False)
+        non_essential = cy.Utils.get_non_essential_genes(return_series=False)
+
+        # Cache of the genes and essential lists
+        key = DataFingerprint.hash(
+            list(df.index), sorted(essential), sorted(non_essential)
         )
+        metrics_name, scaled_name = f"{name}/{key}/metrics", f"{name}/{key}/scaled"
 
-        return df
+        hashes = pd.Series(
+            [
+                hashlib.sha1(np.ascontiguousarray(df[c].values).tobytes()).hexdigest()
+                for c in df.columns
+            ],
+            index=df.columns,
+        )
+
+        metrics = DataCache.get_frame(metrics_name)
+        scaled = DataCache.get_frame(scaled_name)
+
+        if (metrics is None) or (scaled is None):
+            cached = set()
+
+        else:
+            cached = {
+                c
+                for c in df.columns
+                if (c in metrics.index)
+                and (c in scaled.columns)
+                and (metrics.at[c, "hash"] == hashes[c])
+            }
+
+        new = [c for c in df.columns if c not in cached]
+
+        if len(new) > 0:
+            logging.getLogger("DTrace").info(
+                f"CRISPR scaling of {len(new)} samples ({len(cached)} cached)"
+            )
+
+            new_metrics = cls.scale_metrics(df[new], essential, non_essential)
+            new_scaled = cls.scale(df[new], metrics=new_metrics)
+
+            new_metrics = new_metrics.assign(hash=hashes[new])
+
+            # Samples in the cache but not in df are kept
+            if (metrics is not None) and (scaled is not None):
+                new_metrics = pd.concat(
+                    [metrics[~metrics.index.isin(new)], new_metrics]
+                )
+                new_scaled = pd.concat(
+                    [scaled.loc[:, ~scaled.columns.isin(new)], new_scaled], axis=1
+                )
+
+            metrics, scaled = new_metrics, new_scaled
+
+            DataCache.put_frame(scaled_name, scaled)
+            DataCache.put_frame(metrics_name, metrics)
+
+        if scaled.columns.equals(df.columns):
+            return scaled
+
+        return scaled.loc[:, df.columns]
 
 
 class Genomic:
@@ -405,7 +810,7 @@ class Genomic:
     def __init__(
         self, mobem_file="genomic/PANCAN_mobem.csv.gz", drop_factors=True, add_msi=True
     ):
-        self.sample = Sample()
+        self.sample = DataRegistry.get(Sample)
 
         idmap = (
             self.sample.samplesheet.reset_index()
@@ -413,7 +818,7 @@ class Genomic:
             .set_index("COSMIC_ID")["model_id"]
         )
 
-        mobem = pd.read_csv(f"{dpath}/{mobem_file}", index_col=0)
+        mobem = DataCache.read_csv(f"{dpath}/{mobem_file}", index_col=0)
         mobem = mobem[mobem.index.astype(str).isin(idmap.index)]
         mobem = mobem.set_index(idmap[mobem.index.astype(str)].values)
 
@@ -426,11 +831,11 @@ class Genomic:
 
         self.mobem = mobem.astype(int).T
 
-    def get_data(self):
-        return self.mobem.copy()
+    def get_data(self, copy=True):
+        return self.mobem.copy(deep=copy)
 
     def filter(self, subset=None, min_events=5):
-        df = self.get_data()
+        df = self.get_data(copy=False)
 
         # Subset matrices
         if subset is not None:
@@ -497,15 +902,22 @@ class PPI:
             DrugResponse.get_drugtargets() if drug_targets is None else drug_targets
         )
 
-    def ppi_annotation(self, df, ppi_type, ppi_kws, target_thres=5):
+    def ppi_annotation(self, df, ppi_type, ppi_kws, target_thres=5, ppi=None):
+        """
+        :param ppi: Optional network already built (e.g. PPI.build_string_ppi), ppi_type and ppi_kws are then
+            ignored.
+        """
         df_genes, df_drugs = set(df["GeneSymbol"]), set(df["DRUG_ID"])
 
         # PPI annotation
-        if ppi_type == "string":
-            ppi = self.build_string_ppi(**ppi_kws)
+        if ppi is None:
+            if ppi_type == "string":
+                ppi = self.build_string_ppi(**ppi_kws)
 
-        else:
-            raise Exception("ppi_type not supported, choose from: string or biogrid")
+            else:
+                raise Exception(
+                    "ppi_type not supported, choose from: string or biogrid"
+                )
 
         # Drug target
         d_targets = {
@@ -786,18 +1198,19 @@ class GeneExpression:
         voom_file="genomic/rnaseq_voom.csv.gz",
         rpkm_file="genomic/rnaseq_rpkm.csv.gz",
     ):
-        self.voom = pd.read_csv(f"{dpath}/{voom_file}", index_col=0)
-        self.rpkm = pd.read_csv(f"{dpath}/{rpkm_file}", index_col=0)
+        self.voom = DataCache.read_csv(f"{dpath}/{voom_file}", index_col=0)
+        self.rpkm = DataCache.read_csv(f"{dpath}/{rpkm_file}", index_col=0)
 
-    def get_data(self, dtype="voom"):
+    def get_data(self, dtype="voom", copy=True):
         if dtype.lower() == "rpkm":
-            return self.rpkm.copy()
+            return self.rpkm.copy(deep=copy)
 
         else:
-            return self.voom.copy()
+            return self.voom.copy(deep=copy)
 
     def filter(self, dtype="voom", subset=None):
-        df = self.get_data(dtype=dtype)
+        # Deep copy only without subset, otherwise the selection below allocates a new frame
+        df = self.get_data(dtype=dtype, copy=subset is None)
 
         # Subset matrices
         if subset is not None:
@@ -833,13 +1246,14 @@ class GeneExpression:
 
 class CopyNumber:
     def __init__(self, cnv_file="genomic/copynumber_total_new_map.csv.gz"):
-        self.copynumber = pd.read_csv(f"{dpath}/{cnv_file}", index_col=0)
+        self.copynumber = DataCache.read_csv(f"{dpath}/{cnv_file}", index_col=0)
 
-    def get_data(self):
-        return self.copynumber.copy()
+    def get_data(self, copy=True):
+        return self.copynumber.copy(deep=copy)
 
     def filter(self, subset=None):
-        df = self.get_data()
+        # Deep copy only without subset, otherwise the selection below allocates a new frame
+        df = self.get_data(copy=subset is None)
 
         # Subset matrices
         if subset is not None:
@@ -922,7 +1336,7 @@ class RNAi:
         rnai = rnai.rename(columns=sinfo)
 
         cpass = (
-            Sample()
+            DataRegistry.get(Sample)
             .samplesheet.dropna(subset=["BROAD_ID"])
             .reset_index()
             .set_index("BROAD_ID")["model_id"]
@@ -932,11 +1346,12 @@ class RNAi:
 
         return rnai
 
-    def get_data(self):
-        return self.rnai.copy()
+    def get_data(self, copy=True):
+        return self.rnai.copy(deep=copy)
 
     def filter(self, subset=None):
-        df = self.get_data()
+        # Deep copy only without subset, otherwise the selection below allocates a new frame
+        df = self.get_data(copy=subset is None)
 
         if subset is not None:
             df = df.loc[:, df.columns.isin(subset)]
@@ -1039,11 +1454,12 @@ class KinobeadCATDS:
 
         return catds
 
-    def get_data(self):
-        return self.catds.copy()
+    def get_data(self, copy=True):
+        return self.catds.copy(deep=copy)
 
     def filter(self, subset=None):
-        df = self.get_data()
+        # Deep copy only without subset, otherwise the selection below allocates a new frame
+        df = self.get_data(copy=subset is None)
 
         # Subset matrices
         if subset is not None:
@@ -1058,7 +1474,8 @@ if __name__ == "__main__":
 
     samples = list(
         set.intersection(
-            set(drug_response.get_data().columns), set(crispr.get_data().columns)
+            set(drug_response.get_data(copy=False).columns),
+            set(crispr.get_data(copy=False).columns),
         )
     )
 
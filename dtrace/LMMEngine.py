@@ -0,0 +1,696 @@
+#!/usr/bin/env python
+# Copyright (C) 2019 Emanuel Goncalves
+
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2
+from scipy.optimize import minimize_scalar
+from collections import OrderedDict
+from sklearn.utils.extmath import randomized_svd
+
+
+class LMMEngine:
+    """
+    Native linear mixed model association engine (EMMAX/P3D). The variance components of a trait are estimated once
+    under the null model (covariates only) and kept fixed while all candidate features are tested with a single
+    batched generalised least squares computation in the space rotated by the eigendecomposition of the kinship.
+
+    The model follows LIMIX parametrisation, cov(y) = s((1 - delta)K + delta I), and reports the same statistics as
+    limix.qtl.scan: effect sizes, their standard errors and likelihood-ratio test p-values (1 degree of freedom).
+
+    """
+
+    EPSILON = np.sqrt(np.finfo(float).eps)
+
+    def __init__(self, y, m=None, qs=None, delta=None):
+        """
+        :param y: Trait measurements (n samples).
+
+        :param m: Covariates matrix (n samples x c covariates). A column of ones is used if None.
+
+        :param qs: Economic eigendecomposition (Q0, S0) of the kinship matrix (see LMMEngine.economic_qs). If None a
+            linear model without random effects is fitted.
+
+        :param delta: Fixed ratio of the environmental variance. If None it is estimated by maximum likelihood.
+
+        """
+        self.y = np.asarray(y, dtype=np.float64).ravel()
+        self.n = self.y.shape[0]
+
+        self.m = (
+            np.ones((self.n, 1))
+            if m is None
+            else np.asarray(m, dtype=np.float64).reshape(self.n, -1)
+        )
+
+        self.qs = qs
+        self.rank = self.n if qs is None else qs[0].shape[1]
+
+        # Rotated trait and covariates, reused while optimising delta
+        self.ym = np.column_stack([self.y, self.m])
+        self.ym_rot = None if qs is None else qs[0].T @ self.ym
+
+        # Null model
+        if qs is None:
+            self.delta = 1.0
+
+        elif delta is None:
+            self.delta = self.fit_delta()
+
+        else:
+            self.delta = delta
+
+        self.logdet = self.get_logdet(self.delta)
+
+        ym_w = self.whiten(self.ym, rotated=self.ym_rot)
+        self.y_w, self.m_w = ym_w[:, 0], ym_w[:, 1:]
+
+        self.m_u = self.covariates_basis(self.m_w)
+        self.y_res = self.y_w - self.m_u @ (self.m_u.T @ self.y_w)
+
+        self.rss = self.y_res @ self.y_res
+        self.scale = self.rss / self.n
+        self.lml = self.get_lml(self.rss, self.logdet)
+
+    @classmethod
+    def economic_qs(cls, k):
+        """
+        Eigendecomposition of the kinship matrix keeping only the eigenvectors with non-zero eigenvalues.
+
+        :param k: Kinship matrix (n x n).
+        :return: Tuple (Q0, S0)
+        """
+        S, Q = np.linalg.eigh(np.asarray(k, dtype=np.float64))
+
+        ok = S >= cls.EPSILON
+
+        return Q[:, ok], S[ok]
+
+    def get_d(self, delta):
+        return (1 - delta) * self.qs[1] + delta
+
+    def get_logdet(self, delta):
+        if self.qs is None:
+            return 0.0
+
+        logdet = np.log(self.get_d(delta)).sum()
+
+        if self.rank < self.n:
+            logdet += (self.n - self.rank) * np.log(delta)
+
+        return logdet
+
+    def get_lml(self, rss, logdet):
+        return -0.5 * (
+            self.n * np.log(2 * np.pi) + logdet + self.n + self.n * np.log(rss / self.n)
+        )
+
+    def whiten(self, a, delta=None, rotated=None):
+        """
+        Multiply a by the inverse square root of the (unscaled) covariance matrix, i.e. generalised least squares on
+        the original space becomes ordinary least squares on the whitened space.
+
+        :param a: Matrix (n x p).
+        :param delta: Environmental variance ratio, defaults to the null model estimate.
+        :param rotated: Optional precomputed Q0.T @ a.
+        :return: Matrix (n x p) if K is rank deficient, otherwise (rank x p).
+        """
+        if self.qs is None:
+            return a
+
+        delta = self.delta if delta is None else delta
+        rotated = self.qs[0].T @ a if rotated is None else rotated
+
+        d_isqrt = 1 / np.sqrt(self.get_d(delta))
+
+        if self.rank == self.n:
+            return rotated * (d_isqrt[:, None] if rotated.ndim == 2 else d_isqrt)
+
+        d_isqrt -= 1 / np.sqrt(delta)
+        d_isqrt = d_isqrt[:, None] if rotated.ndim == 2 else d_isqrt
+
+        return self.qs[0] @ (rotated * d_isqrt) + a / np.sqrt(delta)
+
+    @classmethod
+    def covariates_basis(cls, m_w):
+        """
+        Orthonormal basis of the column space of the whitened covariates. Collinear covariates (e.g. dummy variables
+        together with the intercept) are handled by discarding null singular values.
+
+        """
+        u, s, _ = np.linalg.svd(m_w, full_matrices=False)
+        return u[:, s > (cls.EPSILON * s.max())]
+
+    def null_lml(self, delta):
+        ym_w = self.whiten(self.ym, delta=delta, rotated=self.ym_rot)
+        y_w, m_u = ym_w[:, 0], self.covariates_basis(ym_w[:, 1:])
+
+        y_res = y_w - m_u @ (m_u.T @ y_w)
+
+        return self.get_lml(y_res @ y_res, self.get_logdet(delta))
+
+    def fit_delta(self):
+        lbound = 0.0 if self.rank == self.n else self.EPSILON
+
+        opt = minimize_scalar(
+            lambda v: -self.null_lml(v),
+            bounds=(lbound, 1.0),
+            method="bounded",
+            options=dict(xatol=1e-6),
+        )
+
+        candidates = [opt.x, lbound, 1.0]
+        lmls = [self.null_lml(v) for v in candidates]
+
+        return candidates[int(np.argmax(lmls))]
+
+    def residualise(self, x_w):
+        return x_w - self.m_u @ (self.m_u.T @ x_w)
+
+    def scan(self, x):
+        """
+        Test each column of x as an additional fixed effect, keeping delta fixed at the null model estimate and
+        re-estimating the scale by maximum likelihood.
+
+        :param x: Candidate features (n samples x p features), numpy array or pandas DataFrame.
+        :return: pandas DataFrame with effect_name, effsize, effsize_se and pv20 (likelihood-ratio test p-value).
+        """
+        names = x.columns if isinstance(x, pd.DataFrame) else np.arange(x.shape[1])
+
+        x_res = self.residualise(self.whiten(np.asarray(x, dtype=np.float64)))
+
+        xx = (x_res**2).sum(0)
+        xy = x_res.T @ self.y_res
+
+        beta, beta_se, pval = self.lrt_stats(xx, xy, self.rss, self.n)
+
+        return pd.DataFrame(
+            dict(effect_name=names, effsize=beta, effsize_se=beta_se, pv20=pval)
+        )
+
+    def interaction_scan(self, g, f):
+        """
+        Test the interaction g:f of a fixed feature g (e.g. gene essentiality) with each column of f (e.g. genomic
+        events) in the model y ~ covariates + g + f_j + g:f_j, keeping delta fixed at the null model estimate. The
+        main effects of each f_j are partialled out in closed form, so all columns are tested with a few matrix
+        products instead of one fit per column.
+
+        :param g: Feature (n samples).
+        :param f: Modifier features (n samples x p features).
+        :return: Tuple of arrays (beta, beta_se, pval) of the interaction terms (p features)
+        """
+        g = np.asarray(g, dtype=np.float64).ravel()
+        f = np.asarray(f, dtype=np.float64).reshape(self.n, -1)
+
+        # Residualise on covariates and the main effect of g
+        g_res = self.residualise(self.whiten(g[:, None]))
+        gg = (g_res**2).sum()
+
+        if gg > (self.EPSILON * self.n):
+            g_res = g_res / np.sqrt(gg)
+
+        else:
+            g_res = np.zeros_like(g_res)
+
+        def residualise_g(a):
+            a = self.residualise(a)
+            return a - g_res @ (g_res.T @ a)
+
+        r_y = residualise_g(self.y_res[:, None])[:, 0]
+        r_f = residualise_g(self.whiten(f))
+        r_z = residualise_g(self.whiten(g[:, None] * f))
+
+        # Partial out the main effect of each f_j from the interaction term and the trait
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ff = (r_f**2).sum(0)
+            ff = np.where(ff > (self.EPSILON * self.n), ff, np.nan)
+
+            fz = (r_f * r_z).sum(0)
+            fy = r_f.T @ r_y
+
+            xx = (r_z**2).sum(0) - fz**2 / ff
+            xy = r_z.T @ r_y - fz * fy / ff
+            rss = r_y @ r_y - fy**2 / ff
+
+        return self.lrt_stats(xx, xy, rss, self.n)
+
+    def score_test(self, x):
+        """
+        Score (Rao) test of each column of x under the null model, i.e. without re-estimating the scale. Score
+        statistics are never larger than the likelihood-ratio statistics computed by scan, hence score p-values
+        can be used to conservatively screen out null features.
+
+        :param x: Candidate features (n samples x p features), numpy array or pandas DataFrame.
+        :return: pandas DataFrame with effect_name, effsize, effsize_se and pv20 (score test p-value).
+        """
+        names = x.columns if isinstance(x, pd.DataFrame) else np.arange(x.shape[1])
+
+        x_res = self.residualise(self.whiten(np.asarray(x, dtype=np.float64)))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            xx = (x_res**2).sum(0)
+            xx = np.where(xx > (self.EPSILON * self.n), xx, np.nan)
+
+            xy = x_res.T @ self.y_res
+
+            beta = xy / xx
+            beta_se = np.sqrt(self.scale / xx)
+
+        pval = chi2(1).sf((beta / beta_se) ** 2)
+
+        return pd.DataFrame(
+            dict(effect_name=names, effsize=beta, effsize_se=beta_se, pv20=pval)
+        )
+
+    def permutation_test(self, x, n_permutations=100, batch_size=100, seed=None):
+        """
+        Permutation-calibrated significance of the features tested by scan. The whitened null model residuals are
+        exchangeable under the null hypothesis, hence they are permuted in the whitened (decorrelated) space and
+        re-residualised on the covariates. Batches of permutations are evaluated with a single matrix product
+        against the fixed features, keeping only the per feature exceedance counts and the pooled histogram of
+        the permuted statistics over the observed ones.
+
+        :param x: Candidate features (n samples x p features), numpy array or pandas DataFrame.
+        :param n_permutations: Number of permutations of the trait.
+        :param batch_size: Number of permutations evaluated in each matrix product.
+        :param seed: Seed of the random number generator.
+        :return: Tuple of arrays (pval_perm, fdr_perm), empirical p-values (1 + exceedances) / (1 + n_permutations)
+            and permutation-based FDR (expected permuted over observed number of statistics above each feature)
+        """
+        x_res = self.residualise(self.whiten(np.asarray(x, dtype=np.float64)))
+
+        # Fraction of the residual variance explained, monotone with the likelihood-ratio statistic
+        with np.errstate(divide="ignore", invalid="ignore"):
+            xx = (x_res**2).sum(0)
+            xx = np.where(xx > (self.EPSILON * self.n), xx, np.nan)
+
+            stat = (x_res.T @ self.y_res) ** 2 / xx / self.rss
+
+        valid = ~np.isnan(stat)
+        stat_sorted = np.sort(stat[valid])
+
+        exceedances = np.zeros(stat.shape[0])
+        null_counts = np.zeros(stat_sorted.shape[0] + 1)
+
+        rng = np.random.default_rng(seed)
+
+        for i in range(0, n_permutations, batch_size):
+            n_batch = min(batch_size, n_permutations - i)
+
+            idx = rng.permuted(
+                np.tile(np.arange(self.y_res.shape[0]), (n_batch, 1)), axis=1
+            )
+            y_perm = self.residualise(self.y_res[idx].T)
+
+            stat_perm = (x_res.T @ y_perm) ** 2 / xx[:, None] / (y_perm**2).sum(0)
+
+            exceedances += (stat_perm >= stat[:, None]).sum(1)
+
+            null_counts += np.bincount(
+                np.searchsorted(stat_sorted, stat_perm[valid].ravel(), side="right"),
+                minlength=stat_sorted.shape[0] + 1,
+            )
+
+        pval = np.where(valid, (1 + exceedances) / (1 + n_permutations), np.nan)
+
+        # Number of permuted (per permutation) and observed statistics greater or equal than each observed one
+        null_ge = np.cumsum(null_counts[::-1])[::-1][1:] / n_permutations
+        obs_ge = stat_sorted.shape[0] - np.searchsorted(
+            stat_sorted, stat_sorted, side="left"
+        )
+
+        fdr_sorted = np.clip(np.minimum.accumulate(null_ge / obs_ge), 0, 1)
+
+        fdr = np.full(stat.shape[0], np.nan)
+        fdr[valid] = fdr_sorted[np.searchsorted(stat_sorted, stat[valid], side="left")]
+
+        return pval, fdr
+
+    @classmethod
+    def lrt_stats(cls, xx, xy, rss, n):
+        """
+        Effect sizes, standard errors and likelihood-ratio test p-values of single features given the residualised
+        sums of squares and products. Arrays broadcast, e.g. xx (p x 1), xy (p x d) and rss (d) for d traits.
+
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            xx = np.where(xx > (cls.EPSILON * n), xx, np.nan)
+
+            beta = xy / xx
+            rss_alt = np.clip(rss - xy * beta, rss * cls.EPSILON, None)
+
+            beta_se = np.sqrt(rss_alt / n / xx)
+            lrt = np.clip(n * np.log(rss / rss_alt), 0, None)
+
+        return beta, beta_se, chi2(1).sf(lrt)
+
+    @classmethod
+    def ols_scan(cls, y, x, m=None):
+        """
+        Closed-form linear model (no random effects) of every trait in y against every feature in x, sharing the
+        same samples and covariates. Equivalent to LMMEngine(y[:, j], m).scan(x) for all j, computed with a few
+        matrix products.
+
+        :param y: Traits (n samples x d traits).
+        :param x: Features (n samples x p features).
+        :param m: Covariates (n samples x c covariates). A column of ones is used if None.
+        :return: dict with effsize, effsize_se and pv20 arrays (p features x d traits)
+        """
+        y, x = np.asarray(y, dtype=np.float64), np.asarray(x, dtype=np.float64)
+        n = y.shape[0]
+
+        m = np.ones((n, 1)) if m is None else np.asarray(m, dtype=np.float64)
+        m_u = cls.covariates_basis(m.reshape(n, -1))
+
+        y_res = y - m_u @ (m_u.T @ y)
+        x_res = x - m_u @ (m_u.T @ x)
+
+        xx = (x_res**2).sum(0)[:, None]
+        xy = x_res.T @ y_res
+        rss = (y_res**2).sum(0)[None, :]
+
+        beta, beta_se, pval = cls.lrt_stats(xx, xy, rss, n)
+
+        return dict(effsize=beta, effsize_se=beta_se, pv20=pval)
+
+
+class MultiTraitLMMEngine:
+    """
+    Joint linear mixed model of two traits measured in the same samples (e.g. the GDSC1 and GDSC2 screens of the
+    same compound), cov(vec(Y)) = Cg (x) K + Cn (x) I with 2 x 2 genetic (Cg) and environmental (Cn) trait
+    covariances, each trait with its own covariates.
+
+    Cg and Cn are not estimated by maximum likelihood of the joint model. Their diagonals are taken from the null
+    models of each trait fitted separately (LMMEngine), and the cross-covariances are estimated by least squares
+    (method of moments) from the products of the two traits' residuals in the eigenspace of K. Trait covariances
+    are then fixed and every feature is tested with batched generalised least squares (EMMAX/P3D), reporting the
+    shared effect on both traits, the trait specific effects and their likelihood-ratio tests.
+
+    """
+
+    # Bound on the cross-trait correlations, keeps the trait covariances positive definite
+    MAX_CORR = 0.99
+
+    def __init__(self, y, m=None, qs=None):
+        """
+        :param y: Traits measurements (n samples x 2 traits).
+
+        :param m: Covariates matrix (n samples x c covariates), used for both traits. A column of ones is used if
+            None.
+
+        :param qs: Economic eigendecomposition (Q0, S0) of the kinship matrix (see LMMEngine.economic_qs). If None a
+            linear model without random effects is fitted.
+
+        """
+        self.y = np.asarray(y, dtype=np.float64)
+        self.n = self.y.shape[0]
+
+        self.m = (
+            np.ones((self.n, 1))
+            if m is None
+            else np.asarray(m, dtype=np.float64).reshape(self.n, -1)
+        )
+
+        self.qs = qs
+        self.rank = 0 if qs is None else qs[0].shape[1]
+
+        # Univariate null models
+        self.lmms = [LMMEngine(self.y[:, i], m=self.m, qs=qs) for i in range(2)]
+
+        self.cg, self.cn = self.trait_covariances()
+
+        # Whitening matrices of each eigen-component and of the complement of K column space
+        s0 = np.zeros(0) if qs is None else qs[1]
+        self.w_k = self.inv_sqrt(s0[:, None, None] * self.cg + self.cn)
+        self.w_n = self.inv_sqrt(self.cn[None])[0]
+
+        # Joint null model
+        zeros = np.zeros_like(self.m)
+
+        self.y_w = self.whiten(self.y[:, [0]], self.y[:, [1]])[:, 0]
+        self.m_w = np.hstack([self.whiten(self.m, zeros), self.whiten(zeros, self.m)])
+
+        self.m_u = LMMEngine.covariates_basis(self.m_w)
+        self.y_res = self.residualise(self.y_w[:, None])[:, 0]
+
+        self.rss = self.y_res @ self.y_res
+
+    @staticmethod
+    def inv_sqrt(c):
+        """
+        Symmetric inverse square root of a stack of 2 x 2 covariance matrices (k x 2 x 2).
+
+        """
+        s, v = np.linalg.eigh(c)
+        return (v / np.sqrt(s)[:, None, :]) @ np.swapaxes(v, 1, 2)
+
+    def trait_covariances(self):
+        scales = np.array([lmm.scale for lmm in self.lmms])
+        deltas = np.array([lmm.delta for lmm in self.lmms])
+
+        g, e = scales * (1 - deltas), scales * deltas
+
+        # Residuals of each trait in the original space
+        res = np.column_stack(
+            [
+                lmm.y - lmm.m @ np.linalg.lstsq(lmm.m_w, lmm.y_w, rcond=None)[0]
+                for lmm in self.lmms
+            ]
+        )
+
+        res_prod = res[:, 0] @ res[:, 1]
+
+        if self.qs is None:
+            g12, e12 = 0.0, res_prod / self.n
+
+        else:
+            # E[r1k r2k] = S_k g12 + e12 in the eigenspace, E[r1 r2] = e12 in its complement
+            rot = self.qs[0].T @ res
+            rot_prod = rot[:, 0] * rot[:, 1]
+
+            s0 = self.qs[1]
+
+            ata = np.array([[(s0**2).sum(), s0.sum()], [s0.sum(), self.n]])
+            atb = np.array([s0 @ rot_prod, res_prod])
+
+            g12, e12 = np.linalg.lstsq(ata, atb, rcond=None)[0]
+
+        g12, e12 = self.bound_covariance(g12, g), self.bound_covariance(e12, e)
+
+        return np.array([[g[0], g12], [g12, g[1]]]), np.array(
+            [[e[0], e12], [e12, e[1]]]
+        )
+
+    @classmethod
+    def bound_covariance(cls, c12, c):
+        sd = np.sqrt(c[0] * c[1])
+
+        if sd <= LMMEngine.EPSILON:
+            return 0.0
+
+        return np.clip(c12 / sd, -cls.MAX_CORR, cls.MAX_CORR) * sd
+
+    def whiten(self, a1, a2):
+        """
+        Multiply the joint vector (a1, a2) by the inverse square root of the (fixed) joint covariance.
+
+        :param a1: Matrix (n x p) of the first trait.
+        :param a2: Matrix (n x p) of the second trait.
+        :return: Matrix (2 rank + 2n x p) if K is rank deficient, otherwise (2n x p)
+        """
+        parts = []
+
+        if self.qs is not None:
+            r1, r2 = self.qs[0].T @ a1, self.qs[0].T @ a2
+
+            w = self.w_k[:, :, :, None]
+            parts += [
+                w[:, 0, 0] * r1 + w[:, 0, 1] * r2,
+                w[:, 1, 0] * r1 + w[:, 1, 1] * r2,
+            ]
+
+        if self.rank < self.n:
+            if self.qs is not None:
+                a1, a2 = a1 - self.qs[0] @ r1, a2 - self.qs[0] @ r2
+
+            w = self.w_n
+            parts += [w[0, 0] * a1 + w[0, 1] * a2, w[1, 0] * a1 + w[1, 1] * a2]
+
+        return np.vstack(parts)
+
+    def residualise(self, a_w):
+        return a_w - self.m_u @ (self.m_u.T @ a_w)
+
+    def scan(self, x, block_size=1000):
+        """
+        Test each column of x with shared (same effect on both traits) and trait specific effects.
+
+        :param x: Candidate features (n samples x p features), numpy array or pandas DataFrame.
+        :param block_size: Number of features whitened at once, bounds the memory used.
+        :return: pandas DataFrame with effect_name; effsize, effsize_se and pv20 of the shared effect; effsize and
+            effsize_se of each trait (suffixes _t1 and _t2); pv_joint, likelihood-ratio test of any effect (2 degrees
+            of freedom); pv_het, likelihood-ratio test of different effects in the two traits (1 degree of freedom)
+        """
+        names = x.columns if isinstance(x, pd.DataFrame) else np.arange(x.shape[1])
+        x = np.asarray(x, dtype=np.float64)
+
+        n, rss0 = 2 * self.n, self.rss
+
+        res = []
+
+        for i in range(0, x.shape[1], block_size):
+            x_block = x[:, i : i + block_size]
+            zeros = np.zeros_like(x_block)
+
+            x1 = self.residualise(self.whiten(x_block, zeros))
+            x2 = self.residualise(self.whiten(zeros, x_block))
+
+            a, b, d = (x1**2).sum(0), (x1 * x2).sum(0), (x2**2).sum(0)
+            u1, u2 = x1.T @ self.y_res, x2.T @ self.y_res
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                # Shared effect
+                beta, beta_se, pval = LMMEngine.lrt_stats(
+                    a + 2 * b + d, u1 + u2, rss0, n
+                )
+
+                # Trait specific effects
+                det = a * d - b**2
+                det = np.where(det > (LMMEngine.EPSILON * n * (a + d)), det, np.nan)
+
+                beta_1, beta_2 = (d * u1 - b * u2) / det, (a * u2 - b * u1) / det
+
+                rss_shared = rss0 - (u1 + u2) * beta
+                rss_full = np.clip(
+                    rss0 - (beta_1 * u1 + beta_2 * u2), rss0 * LMMEngine.EPSILON, None
+                )
+
+                beta_1_se = np.sqrt(rss_full / n * d / det)
+                beta_2_se = np.sqrt(rss_full / n * a / det)
+
+                lrt_joint = np.clip(n * np.log(rss0 / rss_full), 0, None)
+                lrt_het = np.clip(n * np.log(rss_shared / rss_full), 0, None)
+
+            res.append(
+                pd.DataFrame(
+                    dict(
+                        effsize=beta,
+                        effsize_se=beta_se,
+                        pv20=pval,
+                        effsize_t1=beta_1,
+                        effsize_se_t1=beta_1_se,
+                        effsize_t2=beta_2,
+                        effsize_se_t2=beta_2_se,
+                        pv_joint=chi2(2).sf(lrt_joint),
+                        pv_het=chi2(1).sf(lrt_het),
+                    )
+                )
+            )
+
+        res = pd.concat(res, ignore_index=True)
+        res.insert(0, "effect_name", names)
+
+        return res
+
+
+class KinshipFactor:
+    """
+    Low-rank representation of the kinship K = u diag(s^2) u', with u orthonormal (samples x rank), built from the
+    thin SVD of the samples x features matrix X used to define K = XX'/c (see Association.kinship). The n x n matrix
+    is never formed: the SVD of X is computed once, optionally truncated to the top rank components (FaST-LMM), and
+    the factorisation of any subset of samples is derived from it at O(n rank^2) cost.
+
+    """
+
+    def __init__(self, u, s, index):
+        self.u = u
+        self.s = s
+        self.index = pd.Index(index)
+
+    @classmethod
+    def from_features(cls, x, rank=None):
+        """
+        :param x: pandas DataFrame (samples x features).
+        :param rank: Number of top singular vectors kept. If None the full thin SVD is used and K is exact.
+        """
+        x_scaled = x.values / np.sqrt((x.values**2).sum(1).mean())
+
+        if (rank is None) or (rank >= min(x_scaled.shape)):
+            u, s, _ = np.linalg.svd(x_scaled, full_matrices=False)
+
+        else:
+            u, s, _ = randomized_svd(x_scaled, n_components=rank, random_state=0)
+
+        return cls(u, s, x.index)
+
+    def subset(self, samples):
+        """
+        Factorisation of K restricted to samples, obtained by re-orthonormalising the rows of u diag(s).
+
+        """
+        b = self.u[self.index.get_indexer(samples)] * self.s
+
+        q, r = np.linalg.qr(b)
+        s2, w = np.linalg.eigh(r @ r.T)
+
+        return KinshipFactor(q @ w, np.sqrt(np.clip(s2, 0, None)), samples)
+
+    def economic_qs(self):
+        s2 = self.s**2
+        ok = s2 >= LMMEngine.EPSILON
+
+        return self.u[:, ok], s2[ok]
+
+    def to_dense(self):
+        us = self.u * self.s
+        return us @ us.T
+
+
+class KinshipCache:
+    """
+    Least recently used cache of kinship eigendecompositions keyed by the set of samples used to subset K. Drugs
+    sharing the same pattern of missing measurements reuse the same O(n^3) decomposition.
+
+    """
+
+    def __init__(self, k, maxsize=8):
+        """
+        :param k: Kinship matrix (pandas DataFrame, samples x samples) or KinshipFactor.
+        :param maxsize: Maximum number of decompositions kept in memory.
+
+        """
+        self.k = k
+        self.maxsize = maxsize
+
+        self.cache = OrderedDict()
+        self.hits, self.misses = 0, 0
+
+    def get(self, samples):
+        key = tuple(samples)
+
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        self.misses += 1
+
+        if isinstance(self.k, KinshipFactor):
+            qs = self.k.subset(list(key)).economic_qs()
+
+        else:
+            qs = LMMEngine.economic_qs(self.k.loc[list(key), list(key)].values)
+
+        self.put(key, qs)
+
+        return qs
+
+    def put(self, samples, qs):
+        """
+        Store a decomposition computed elsewhere (e.g. loaded from disk) for samples.
+
+        """
+        self.cache[tuple(samples)] = qs
+
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
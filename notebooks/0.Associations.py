@@ -18,13 +18,21 @@
 # %load_ext autoreload
 # %autoreload 2
 
+from dtrace.DTraceUtils import dpath
 from dtrace.Associations import Association
+from dtrace.AssociationsStore import AssociationStore
 
 
 # ### Import data-sets
 
 # Association files are exported to "dtrace/data/" folder (dpath). Warning, due to the large number of tests executed
-# a complete run of this script takes over 7 hours (3.1 GHz Intel Core i7).
+# a complete run of this script with the LIMIX engine takes over 7 hours (3.1 GHz Intel Core i7). The single feature
+# associations below use the native EMMAX/P3D engine (engine="native"), which estimates the variance components once
+# per drug and tests all features with batched generalised least squares. Results of each drug are checkpointed to
+# "dtrace/data/lmm_runs/" (run_dir) as they complete, re-running an interrupted scan skips the drugs already tested.
+# Associations of each drug are written as they complete to Parquet stores partitioned by drug (store_dir,
+# AssociationStore), which Association (load_associations=True) reads instead of the CSV files; the sorted CSV export is
+# optional.
 
 assoc = Association()
 
@@ -52,24 +60,39 @@ assoc.gexp_obj.perform_pca(subset=assoc.samples)
 
 # ### Drug response ~ CRISPR-Cas9
 
-lmm_dsingle = assoc.lmm_single_associations(verbose=1)
-lmm_dsingle.sort_values(["fdr", "pval"]).to_csv(
-    assoc.lmm_drug_crispr_file, index=False, compression="gzip"
+assoc.lmm_single_associations(
+    engine="native",
+    run_dir=f"{dpath}/lmm_runs/crispr",
+    store_dir=assoc.lmm_drug_crispr_store,
+    verbose=1,
+).to_csv(assoc.lmm_drug_crispr_file, sort_cols=["fdr", "pval"], compression="gzip")
+lmm_dsingle = assoc.read_associations(
+    assoc.lmm_drug_crispr_store, assoc.lmm_drug_crispr_file
 )
 
 
 # ### Drug response ~ Gene expression
 
-lmm_dgexp = assoc.lmm_single_associations(x_dtype="gexp", verbose=1)
-lmm_dgexp.sort_values(["fdr", "pval"]).to_csv(
-    assoc.lmm_drug_gexp_file, index=False, compression="gzip"
-)
+assoc.lmm_single_associations(
+    x_dtype="gexp",
+    engine="native",
+    run_dir=f"{dpath}/lmm_runs/gexp",
+    store_dir=assoc.lmm_drug_gexp_store,
+    verbose=1,
+).to_csv(assoc.lmm_drug_gexp_file, sort_cols=["fdr", "pval"], compression="gzip")
+lmm_dgexp = assoc.read_associations(assoc.lmm_drug_gexp_store, assoc.lmm_drug_gexp_file)
 
 # ### Drug response ~ Genomic (copy number; mutations)
 
-lmm_dgenomic = assoc.lmm_single_associations(x_dtype="genomic", verbose=1)
-lmm_dgenomic.sort_values(["fdr", "pval"]).to_csv(
-    assoc.lmm_drug_genomic_file, index=False, compression="gzip"
+assoc.lmm_single_associations(
+    x_dtype="genomic",
+    engine="native",
+    run_dir=f"{dpath}/lmm_runs/genomic",
+    store_dir=assoc.lmm_drug_genomic_store,
+    verbose=1,
+).to_csv(assoc.lmm_drug_genomic_file, sort_cols=["fdr", "pval"], compression="gzip")
+lmm_dgenomic = assoc.read_associations(
+    assoc.lmm_drug_genomic_store, assoc.lmm_drug_genomic_file
 )
 
 
@@ -82,19 +105,36 @@ lmm_dgenomic.sort_values(["fdr", "pval"]).to_csv(
 # expression) are termed as robust pharmacogenomic associations, since these recapitulate an genomic association with
 # two independent viability screens.
 
+# The drug side of these models is the same as the Drug ~ Genomic/GExp associations above, which are reused
+# (lmm_drug). CRISPR gene ~ Genomic/GExp associations are kept in a persistent cache (crispr_cache_dir) so only genes
+# not yet tested are fitted, e.g. when changing the FDR threshold.
+
 
 # ### (Drug response; CRISPR-Cas9) ~ Genomic
 
-lmm_robust = assoc.lmm_robust_associations(lmm_dsingle)
-lmm_robust.sort_values(["drug_fdr", "drug_pval"]).to_csv(
-    assoc.lmm_robust_genomic_file, index=False, compression="gzip"
+lmm_robust = assoc.lmm_robust_associations(
+    lmm_dsingle,
+    engine="native",
+    lmm_drug=lmm_dgenomic,
+    crispr_cache_dir=f"{dpath}/lmm_runs/robust_crispr_genomic",
+)
+AssociationStore(assoc.lmm_robust_genomic_store).write(lmm_robust)
+AssociationStore(assoc.lmm_robust_genomic_store).to_csv(
+    assoc.lmm_robust_genomic_file, sort_cols=["drug_fdr", "drug_pval"], compression="gzip"
 )
 
 # ### (Drug response; CRISPR-Cas9) ~ Gene expression
 
-lmm_robust_gexp = assoc.lmm_robust_associations(lmm_dsingle, x_dtype="gexp")
-lmm_robust_gexp.sort_values(["drug_fdr", "drug_pval"]).to_csv(
-    assoc.lmm_robust_gexp_file, index=False, compression="gzip"
+lmm_robust_gexp = assoc.lmm_robust_associations(
+    lmm_dsingle,
+    x_dtype="gexp",
+    engine="native",
+    lmm_drug=lmm_dgexp,
+    crispr_cache_dir=f"{dpath}/lmm_runs/robust_crispr_gexp",
+)
+AssociationStore(assoc.lmm_robust_gexp_store).write(lmm_robust_gexp)
+AssociationStore(assoc.lmm_robust_gexp_store).to_csv(
+    assoc.lmm_robust_gexp_file, sort_cols=["drug_fdr", "drug_pval"], compression="gzip"
 )
 
 # Copyright (C) 2019 Emanuel Goncalves
@@ -80,6 +80,7 @@ setuptools.setup(
     include_package_data=True,
     package_data=included_files,
     install_requires=requirements,
+    python_requires=">=3.8",
     classifiers=(
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: BSD License",